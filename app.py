@@ -1,48 +1,182 @@
-import os
-from dotenv import load_dotenv
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+import hashlib
+import signal
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, Flask, current_app, render_template, request
+from flask import abort, flash, redirect, session, g
+from flask_wtf.csrf import generate_csrf, validate_csrf
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import configure_mappers, joinedload
+from wtforms.validators import ValidationError
+from werkzeug.local import LocalProxy
 
 from forms import UserAddForm, LoginForm, MessageForm, CSRFForm, UserEditForm
-from models import db, connect_db, User, Message, Like
+from models import db, connect_db, User, Message, Like, Follow, TimelineEntry
 from models import DEFAULT_IMAGE_URL, DEFAULT_HEADER_IMAGE_URL
-
-load_dotenv()
+from pagination import paginate, USERS_PER_PAGE
+from hashing import hasher, HashingBusy
+import database
+import instrumentation
+import replicas
+import fragments
+import jobs
+import purge
+import search
+import timelines
+import trimming
+from current_user import AccountGone, get_current_user, forget_current_user
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+bp = Blueprint('warbler', __name__, cli_group=None)
+
+
+def create_app(config_name=None):
+    """Create and configure a Warbler app.
+
+    `config_name` is one of config.CONFIGS; see config.py for how it is
+    chosen when left out. Run with `flask run`, or in production with
+    gunicorn (see gunicorn.conf.py).
+    """
+
+    from dotenv import load_dotenv
+
+    import config
+
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.config.from_object(
+        config.CONFIGS[config_name or config.config_name()]())
+
+    if app.config['DEBUG_TB_ENABLED']:
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+    connect_db(app)
+    instrumentation.init_app(app)
+    replicas.init_app(app)
+    fragments.init_app(app)
+    app.add_template_global(generate_csrf, 'csrf_token')
+    app.register_blueprint(bp)
 
-connect_db(app)
+    if app.config['WARM_UP']:
+        warm_up(app)
+
+    return app
+
+
+def warm_up(app):
+    """Do the work a worker's first requests would otherwise pay for:
+    compiling every template and configuring the model mappers."""
+
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+    configure_mappers()
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
+    g.user = None
+
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = get_current_user(session[CURR_USER_KEY])
+
+        # Deactivated or purged
+        if g.user is None:
+            do_logout()
 
-    else:
-        g.user = None
 
-@app.before_request
+@bp.before_app_request
 def add_csrfform_to_g():
-    """Establish global csrf form"""
+    """Establish global csrf form, built the first time it's used"""
+
+    g.pop("_csrf_form", None)
+    g.csrf_form = LocalProxy(get_csrf_form)
+
+
+def get_csrf_form():
+    """Return this request's CSRF form, creating it if needed."""
+
+    if "_csrf_form" not in g:
+        g._csrf_form = CSRFForm()
+
+    return g._csrf_form
+
+
+def get_active_user_or_404(user_id):
+    """Return the user with `user_id`; 404 if missing or deactivated."""
+
+    user = db.session.get(User, user_id)
+
+    if user is None or user.deactivated_at is not None:
+        abort(404)
+
+    return user
+
+
+def load_liked_ids(messages):
+    """Store which of `messages` the current user likes, for like-form.html.
+
+    One query per page, limited to the messages being rendered.
+    """
+
+    g.liked_ids = Like.liked_ids(g.user.id, [msg.id for msg in messages])
+
+
+def load_following_ids(users):
+    """Store which of `users` the current user follows, for user cards.
+
+    One query per page, limited to the users being rendered.
+    """
+
+    g.following_ids = g.user.following_ids([user.id for user in users])
+
+
+def not_modified(*parts):
+    """Tag this page with an ETag built from everything it shows.
+
+    `parts` are the page's own values (ids, versions, counts, ...); the
+    viewer, their CSRF token and its age are added here. Returns a 304
+    response if the browser already has this version of the page, else
+    None so the caller renders it. Pages with pending flash messages are
+    never tagged, since showing the messages consumes them.
+    """
+
+    if session.get('_flashes'):
+        return None
 
-    g.csrf_form = CSRFForm()
+    # Pages embed a CSRF token that expires; stop revalidating a copy
+    # before its token is more than half way to expiry
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    token_age = int(time.time() // (time_limit / 2)) if time_limit else 0
+
+    # Every page embeds a CSRF token; make sure the session has one first
+    generate_csrf()
+
+    parts = (
+        g.user.id,
+        g.user.username,
+        g.user.image_url,
+        session.get('csrf_token'),
+        token_age,
+    ) + parts
+    g.etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    if request.if_none_match.contains(g.etag):
+        return current_app.response_class(status=304)
+
+    return None
 
 
 def do_login(user):
@@ -58,7 +192,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -96,7 +230,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login and redirect to homepage on success."""
 
@@ -109,6 +243,8 @@ def login():
         )
 
         if user:
+            # Saves the password hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -118,7 +254,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@bp.post('/logout')
 def logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -136,28 +272,45 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@bp.get('/users')
 def list_users():
-    """Page with listing of users.
+    """Page with listing of users, a page at a time.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username; users
+    whose name starts with 'q' are listed first, and terms shorter than
+    three characters only match the start of names.
     """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    search = request.args.get('q')
+    term = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if not term:
+        users, next_cursor = paginate(
+            User.query.filter(User.deactivated_at.is_(None)),
+            (User.username,),
+            key=lambda user: (user.username,),
+            before=request.args.get('after'),
+            per_page=USERS_PER_PAGE,
+            descending=False,
+        )
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users, next_cursor = User.search(
+            term, after=request.args.get('after'))
 
-    return render_template('users/index.html', users=users)
+    load_following_ids(users)
 
+    return render_template(
+        'users/index.html',
+        users=users,
+        next_cursor=next_cursor,
+        cursor_param='after',
+    )
 
-@app.get('/users/<int:user_id>')
+
+@bp.get('/users/<int:user_id>')
 def show_user(user_id):
     """Show user profile."""
 
@@ -165,12 +318,40 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-
-    return render_template('users/show.html', user=user)
-
-
-@app.get('/users/<int:user_id>/following')
+    user = get_active_user_or_404(user_id)
+    messages, next_cursor = paginate(
+        Message.query.filter(Message.user_id == user_id),
+        (Message.timestamp, Message.id),
+        key=lambda message: (message.timestamp, message.id),
+        before=request.args.get('before'),
+    )
+    load_liked_ids(messages)
+    load_following_ids([user])
+
+    response = not_modified(
+        user.id,
+        user.profile_version,
+        user.messages_count,
+        user.following_count,
+        user.followers_count,
+        user.likes_count,
+        user.id in g.following_ids,
+        [message.id for message in messages],
+        sorted(g.liked_ids),
+        next_cursor,
+    )
+    if response:
+        return response
+
+    return render_template(
+        'users/show.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+    )
+
+
+@bp.get('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -178,11 +359,27 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
-
-
-@app.get('/users/<int:user_id>/followers')
+    user = get_active_user_or_404(user_id)
+    following, next_cursor = paginate(
+        User.query
+            .join(Follow, Follow.user_being_followed_id == User.id)
+            .filter(Follow.user_following_id == user_id),
+        (User.id,),
+        key=lambda followed: (followed.id,),
+        before=request.args.get('before'),
+        per_page=USERS_PER_PAGE,
+    )
+    load_following_ids(following + [user])
+
+    return render_template(
+        'users/following.html',
+        user=user,
+        following=following,
+        next_cursor=next_cursor,
+    )
+
+
+@bp.get('/users/<int:user_id>/followers')
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -190,11 +387,27 @@ def show_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
-
-
-@app.post('/users/follow/<int:follow_id>')
+    user = get_active_user_or_404(user_id)
+    followers, next_cursor = paginate(
+        User.query
+            .join(Follow, Follow.user_following_id == User.id)
+            .filter(Follow.user_being_followed_id == user_id),
+        (User.id,),
+        key=lambda follower: (follower.id,),
+        before=request.args.get('before'),
+        per_page=USERS_PER_PAGE,
+    )
+    load_following_ids(followers + [user])
+
+    return render_template(
+        'users/followers.html',
+        user=user,
+        followers=followers,
+        next_cursor=next_cursor,
+    )
+
+
+@bp.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -205,14 +418,14 @@ def start_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = get_active_user_or_404(follow_id)
+    g.user.follow(followed_user)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@bp.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -223,14 +436,14 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    followed_user = get_active_user_or_404(follow_id)
+    g.user.unfollow(followed_user)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -238,12 +451,13 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    form = UserEditForm(obj=g.user)
+    # The row, not the cached display fields, which another worker may
+    # have seen change
+    user = g.user.load()
+    form = UserEditForm(obj=user)
 
     if form.validate_on_submit():
-        user = User.authenticate(g.user.username, form.password.data)
-
-        if user:
+        if user.check_password(form.password.data):
 
             try:
                 user.username = form.username.data
@@ -254,10 +468,10 @@ def profile():
                 )
                 user.bio = form.bio.data
                 user.location = form.location.data
+                user.profile_version += 1
 
                 db.session.commit()
-                # WHY DOES G.USER UPDATE????
-                print("committed user changes. g.user.bio =", g.user.bio)
+                forget_current_user(user.id)
 
             #Issues Error handling -- getting both integrity errors and rollback
             except IntegrityError:
@@ -273,10 +487,13 @@ def profile():
     return render_template('users/edit.html', form=form)
 
 
-@app.post('/users/delete')
+@bp.post('/users/delete')
 def delete_user():
     """Delete user.
 
+    The account is deactivated at once; its rows are purged afterwards
+    by a background job.
+
     Redirect to signup page.
     """
 
@@ -286,8 +503,10 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    g.user.load().deactivated_at = datetime.utcnow()
+    purge.enqueue_purge(g.user.id)
     db.session.commit()
+    forget_current_user(g.user.id)
 
     return redirect("/signup")
 
@@ -295,7 +514,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def add_message():
     """Add a message:
 
@@ -311,14 +530,43 @@ def add_message():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        trimming.enqueue_trim(g.user.id)
         db.session.commit()
+        timelines.remember_message(msg)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@bp.get('/messages/search')
+def search_messages():
+    """Page of messages matching the 'q' param, best matches first."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    terms = request.args.get('q', '').strip()
+    messages = []
+    next_cursor = None
+
+    if terms:
+        message_ids, next_cursor = search.search_messages(
+            terms, before=request.args.get('before'))
+        messages = Message.in_order(message_ids)
+
+    load_liked_ids(messages)
+
+    return render_template(
+        'messages/search.html',
+        messages=messages,
+        next_cursor=next_cursor,
+        terms=terms,
+    )
+
+
+@bp.get('/messages/<int:message_id>')
 def show_message(message_id):
     """Show a message."""
 
@@ -326,11 +574,26 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    msg = (Message
+           .query
+           .options(joinedload(Message.user))
+           .get_or_404(message_id))
+    load_liked_ids([msg])
+    load_following_ids([msg.user])
+
+    response = not_modified(
+        msg.id,
+        msg.user.profile_version,
+        msg.user.id in g.following_ids,
+        msg.id in g.liked_ids,
+    )
+    if response:
+        return response
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.post('/messages/<int:message_id>/delete')
+@bp.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
@@ -345,6 +608,8 @@ def delete_message(message_id):
     msg = Message.query.get_or_404(message_id)
     db.session.delete(msg)
     db.session.commit()
+    fragments.forget_message(message_id)
+    timelines.forget_message(msg)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -353,41 +618,121 @@ def delete_message(message_id):
 # Homepage and error pages
 
 
-@app.get('/')
+@bp.get('/')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of self & followed_users
+    - logged in: most recent messages of self & followed_users, a page
+      at a time
     """
 
     if g.user:
-        followed_ids = [user.id for user in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(followed_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        page = None
+
+        if current_app.config['TIMELINE_ENGINE'] == 'merge':
+            page = timelines.home_timeline(
+                g.user.id, request.args.get('before'))
+
+        if page is None:
+            page = paginate(
+                Message.query
+                    .options(joinedload(Message.user))
+                    .join(TimelineEntry,
+                          TimelineEntry.message_id == Message.id)
+                    .filter(TimelineEntry.user_id == g.user.id),
+                (TimelineEntry.timestamp, TimelineEntry.message_id),
+                key=lambda message: (message.timestamp, message.id),
+                before=request.args.get('before'),
+            )
 
-        return render_template('home.html', messages=messages)
+        messages, next_cursor = page
+        load_liked_ids(messages)
+
+        response = not_modified(
+            g.user.header_image_url,
+            g.user.messages_count,
+            g.user.following_count,
+            g.user.followers_count,
+            [(message.id, message.user.profile_version)
+             for message in messages],
+            sorted(g.liked_ids),
+            next_cursor,
+        )
+        if response:
+            return response
+
+        return render_template(
+            'home.html',
+            messages=messages,
+            next_cursor=next_cursor,
+        )
 
     else:
         return render_template('home-anon.html')
 
 
-@app.after_request
+@bp.app_errorhandler(HashingBusy)
+def password_hashing_busy(error):
+    """Ask the client to retry when too many logins are in progress."""
+
+    return "Too many sign-ins right now. Please try again.", 503, {
+        "Retry-After": "1",
+    }
+
+
+@bp.app_errorhandler(AccountGone)
+def account_gone(error):
+    """Log out a user whose account went away after it was cached."""
+
+    do_logout()
+    g.user = None
+    flash("Access unauthorized.", "danger")
+
+    return redirect("/")
+
+
+@bp.get('/_stats')
+def show_stats():
+    """Runtime metrics for this worker, as JSON, when STATS_ENABLED."""
+
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+
+    return {
+        "password_hashing": hasher.stats(),
+        "message_fragments": fragments.message_fragments.stats(),
+        "recent_messages": timelines.recent_messages.stats(),
+        "db_pool": database.pool_stats(db.engine),
+    }
+
+
+@bp.after_app_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add caching headers on every request.
+
+    Pages tagged by not_modified() may be kept by the browser, but only
+    privately and revalidated on every use; nothing else is stored.
+    """
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    etag = g.pop("etag", None)
+
+    if etag:
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+
+    else:
+        response.cache_control.no_store = True
+
     return response
 
 ##############################################################################
 # Likes
 
-@app.post('/messages/<int:message_id>/like')
+@bp.post('/messages/<int:message_id>/like')
 def add_like(message_id):
     """handles liking a warble"""
 
@@ -400,12 +745,13 @@ def add_like(message_id):
             )
         db.session.add(new_like)
         db.session.commit()
+        fragments.forget_message(message_id)
         return redirect(f'{request.form["requesting_page"]}')
 
     else:
         return redirect(f'{request.form["requesting_page"]}')
 
-@app.post('/messages/<int:message_id>/unlike')
+@bp.post('/messages/<int:message_id>/unlike')
 def remove_like(message_id):
     """handles liking / unliking a warble"""
 
@@ -421,11 +767,12 @@ def remove_like(message_id):
         if like:
             db.session.delete(like)
             db.session.commit()
+            fragments.forget_message(message_id)
 
     return redirect(f'{request.form["requesting_page"]}')
 
 
-@app.get('/users/<int:user_id>/likes')
+@bp.get('/users/<int:user_id>/likes')
 def show_liked_messages(user_id):
     """Show list of liked messages from this user."""
 
@@ -434,8 +781,245 @@ def show_liked_messages(user_id):
         return redirect("/")
 
 
-    user = User.query.get_or_404(user_id)
+    user = get_active_user_or_404(user_id)
+    messages, next_cursor = paginate(
+        Message.query
+            .options(joinedload(Message.user))
+            .join(Like, Like.message_id == Message.id)
+            .filter(Like.user_id == user_id),
+        (Message.timestamp, Message.id),
+        key=lambda message: (message.timestamp, message.id),
+        before=request.args.get('before'),
+    )
+    load_liked_ids(messages)
+    load_following_ids([user])
+
+    return render_template(
+        '/users/likes.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+    )
+
+
+##############################################################################
+# JSON API
+#
+# Used by static/js/warbler.js so a star or follow click is one small write
+# instead of a redirect and a full page render. Each call needs a logged-in
+# user and the page's CSRF token in the X-CSRFToken header.
+
+
+def check_api_request():
+    """Return an error response if this API call isn't allowed, else None."""
+
+    if not g.user:
+        return {"error": "Access unauthorized."}, 401
+
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            return {"error": "Missing or invalid CSRF token."}, 400
+
+    return None
+
+
+@bp.post('/api/messages/<int:message_id>/like')
+@bp.post('/api/messages/<int:message_id>/unlike')
+def api_toggle_like(message_id):
+    """Like or unlike a message; return its new like state and count.
+
+    Liking a message that's already liked (or unliking one that isn't)
+    changes nothing.
+    """
+
+    error = check_api_request()
+    if error:
+        return error
+
+    msg = Message.query.get_or_404(message_id)
+    liked = request.path.endswith('/like')
+    like = Like.query.filter_by(
+        user_id=g.user.id, message_id=message_id).one_or_none()
+
+    if liked and not like:
+        db.session.add(Like(user_id=g.user.id, message_id=message_id))
+    elif like and not liked:
+        db.session.delete(like)
+
+    db.session.commit()
+    fragments.forget_message(message_id)
+
+    return {"liked": liked, "likes_count": msg.likes_count}
+
+
+@bp.post('/api/users/<int:user_id>/follow')
+@bp.post('/api/users/<int:user_id>/stop-following')
+def api_toggle_follow(user_id):
+    """Follow or stop following a user; return the new follow state and
+    their follower count.
+
+    Following someone already followed (or unfollowing someone who isn't)
+    changes nothing.
+    """
+
+    error = check_api_request()
+    if error:
+        return error
+
+    user = get_active_user_or_404(user_id)
+
+    if user.id == g.user.id:
+        return {"error": "You can't follow yourself."}, 400
+
+    following = request.path.endswith('/follow')
+
+    if following:
+        g.user.follow(user)
+    else:
+        g.user.unfollow(user)
+
+    db.session.commit()
+
+    return {"following": following, "followers_count": user.followers_count}
+
+
+@bp.post('/api/follows')
+def api_bulk_follow():
+    """Follow and unfollow many users at once, e.g. to import a follow list.
+
+    Takes JSON like {"follow": [1, 2], "unfollow": [3]}; each list is
+    applied in a single statement. Returns the ids whose follow state
+    actually changed and the new following count.
+    """
+
+    error = check_api_request()
+    if error:
+        return error
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {"error": "Expected a JSON object."}, 400
+
+    user_ids = {}
+    for name in ("follow", "unfollow"):
+        ids = data.get(name, [])
+        if (not isinstance(ids, list) or
+                not all(type(id) is int for id in ids)):
+            return {"error": f"{name} must be a list of user ids."}, 400
+        user_ids[name] = ids
+
+    followed = g.user.follow_many(user_ids["follow"])
+    unfollowed = g.user.unfollow_many(user_ids["unfollow"])
+    db.session.commit()
+
+    return {
+        "followed": sorted(followed),
+        "unfollowed": sorted(unfollowed),
+        "following_count": g.user.following_count,
+    }
+
+
+##############################################################################
+# Maintenance commands
+
+
+@bp.cli.command('trim-timelines')
+def trim_timelines():
+    """Trim every materialized home timeline to its maximum length."""
+
+    trimming.trim_timelines()
+
+
+@bp.cli.command('repair-counters')
+def repair_counters():
+    """Recompute the denormalized user and message counters in bulk."""
+
+    User.repair_counters()
+    db.session.commit()
+
+
+@bp.cli.command('purge-deactivated')
+def purge_deactivated():
+    """Finish deleting accounts whose purge job failed or is pending."""
+
+    print(f"Purged {purge.purge_deactivated()} deactivated users")
+
+
+@bp.cli.command('worker')
+@click.option('--threads', default=1, show_default=True,
+              help="Jobs to run at once.")
+@click.option('--once', is_flag=True,
+              help="Run the jobs that are due, then exit.")
+def worker(threads, once):
+    """Run background jobs until stopped (SIGINT / SIGTERM)."""
+
+    if once:
+        print(f"Ran {jobs.run_pending()} jobs")
+        return
+
+    pool = jobs.Worker(current_app._get_current_object(), threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: pool.stop())
+    pool.start()
+
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        pool.stop()
+        pool.join()
+
+
+@bp.cli.command('prune-jobs')
+@click.option('--days', default=7, show_default=True,
+              help="Keep jobs that finished more recently than this.")
+def prune_jobs(days):
+    """Delete old successful jobs."""
+
+    before = datetime.utcnow() - timedelta(days=days)
+    print(f"Deleted {jobs.delete_finished(before)} jobs")
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply any pending schema migrations."""
+
+    import migrations
+
+    applied = migrations.upgrade()
+
+    for name in applied:
+        print(f"Applied {name}")
+
+    if not applied:
+        print("Database is up to date")
+
+
+@bp.cli.command('db-status')
+def db_status():
+    """List the schema migrations and whether each has been applied."""
+
+    import migrations
+
+    applied = migrations.applied_versions(db.session.connection())
+
+    for version, name, module in migrations.available():
+        print(f"{'applied' if version in applied else 'pending':8} "
+              f"{version}_{name}")
+
+
+@bp.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail unless the hot queries use the indexes meant for them."""
+
+    import query_plans
+
+    failures = query_plans.check()
 
+    for name, index, used in failures:
+        print(f"{name}: expected {index}, plan uses {sorted(used) or 'none'}")
 
+    if failures:
+        raise SystemExit(1)
 
-    return render_template(f'/users/likes.html', user=user)
+    print("All hot queries use their indexes")
@@ -0,0 +1,23 @@
+"""Load-testing and benchmark suite for Warbler.
+
+Seeds a dataset of a chosen size, drives the app's routes with a weighted
+mix of requests at a set concurrency, and reports latency percentiles,
+throughput and SQL statements per route. Results are saved as JSON so
+runs before and after a change can be compared.
+
+Point DATABASE_URL at a scratch database; seeding drops every table:
+
+    DATABASE_URL=postgresql:///warbler_bench python -m benchmark \\
+        --users 2000 --messages 20000 --requests 2000 --concurrency 8
+
+    python -m benchmark --compare before.json after.json
+
+By default requests go through Flask's test client in this process. With
+--url they go over HTTP to a running server instead (e.g. a local
+gunicorn); SQL counts then need SQL_STATS_ENABLED=true on the server.
+
+With --startup it instead times fresh processes importing the app,
+creating it and serving their first requests (see startup.py):
+
+    python -m benchmark --startup --runs 10 --output startup.json
+"""
@@ -0,0 +1,152 @@
+"""Command line entry point: python -m benchmark --help"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+import benchmark
+
+
+def compare(before_path, after_path):
+    """Print per-route latency and throughput changes between two runs."""
+
+    with open(before_path) as file:
+        before = json.load(file)["results"]
+    with open(after_path) as file:
+        after = json.load(file)["results"]
+
+    def change(old, new):
+        if old is None or new is None:
+            return "n/a"
+        if not old:
+            return f"{new}"
+        return f"{new} ({(new - old) / old:+.0%})"
+
+    if "steps" in before and "steps" in after:
+        print(f"{'step':<18} {'p50 ms':>18} {'min ms':>18}")
+
+        for step, new in after["steps"].items():
+            old = before["steps"].get(step, {})
+            print(
+                f"{step:<18} "
+                f"{change(old.get('p50_ms'), new['p50_ms']):>18} "
+                f"{change(old.get('min_ms'), new['min_ms']):>18}"
+            )
+
+        return
+
+    print(f"{'route':<10} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} "
+          f"{'req/s':>16} {'sql':>14}")
+
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        old = before["routes"].get(route, {})
+        new = after["routes"].get(route, {})
+        print(
+            f"{route:<10} "
+            f"{change(old.get('p50_ms'), new.get('p50_ms')):>18} "
+            f"{change(old.get('p95_ms'), new.get('p95_ms')):>18} "
+            f"{change(old.get('p99_ms'), new.get('p99_ms')):>18} "
+            f"{change(old.get('requests_per_sec'), new.get('requests_per_sec')):>16} "
+            f"{change(old.get('sql_statements_mean'), new.get('sql_statements_mean')):>14}"
+        )
+
+    print(f"\noverall req/s: "
+          f"{change(before['requests_per_sec'], after['requests_per_sec'])}")
+
+
+def save(run, output=None):
+    """Write `run` to `output` (default: a timestamped file) and print it."""
+
+    output = output or os.path.join(
+        "bench_results",
+        run["meta"]["started_at"].replace(":", "").split(".")[0] + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    with open(output, "w") as file:
+        json.dump(run, file, indent=2)
+
+    json.dump(run["results"], sys.stdout, indent=2)
+    print(f"\nSaved to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description=benchmark.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two saved result files and exit")
+    parser.add_argument("--startup", action="store_true",
+                        help="time worker startup and first requests "
+                             "instead (see benchmark/startup.py)")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="processes started with --startup")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="reuse the data already in the database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--follows", type=int, default=50000)
+    parser.add_argument("--likes", type=int, default=30000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="measured requests across all threads")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mix", type=json.loads, default=None,
+                        help='route weights as JSON, e.g. \'{"home": 1}\'')
+    parser.add_argument("--url",
+                        help="send HTTP requests to this server instead of "
+                             "using the test client")
+    parser.add_argument("--output", default=None,
+                        help="where to save results (default: "
+                             "bench_results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.startup:
+        from benchmark import runner, startup
+
+        results = startup.run(args.runs)
+        meta = dict(
+            started_at=datetime.now(timezone.utc).isoformat(),
+            git_revision=runner.git_revision(),
+            options=vars(args),
+        )
+        save(dict(meta=meta, results=results), args.output)
+        return
+
+    # Imported here so --compare works without a database
+    from app import create_app
+    from benchmark import runner
+
+    app = create_app()
+
+    with app.app_context():
+        if not args.no_seed:
+            runner.seed_dataset(
+                args.users, args.messages, args.follows, args.likes,
+                args.seed)
+
+        results = runner.run(
+            app,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            base_url=args.url,
+            seed=args.seed,
+            mix=args.mix,
+        )
+        meta = runner.metadata(args)
+
+    save(dict(meta=meta, results=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Ways of sending benchmark requests to Warbler.
+
+A driver logs in as one user and exposes get()/post() returning
+(status_code, sql_statements); sql_statements is None when the driver
+can't tell.
+"""
+
+import re
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor
+from urllib.request import HTTPRedirectHandler
+
+from instrumentation import count_queries
+
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+SESSION_COOKIE = "session"
+
+
+class NoRedirects(HTTPRedirectHandler):
+    """Return redirects as responses (HTTPError), like the test client,
+    so a POST is timed without rendering the page it redirects to."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, in this process.
+
+    CSRF checks are switched off for the run, since the test client can't
+    read tokens from forms as cheaply as a browser.
+    """
+
+    def __init__(self, app, user_id):
+        from app import CURR_USER_KEY
+
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def _send(self, method, url, data=None):
+        with count_queries() as stats:
+            resp = self.client.open(url, method=method, data=data)
+
+        return resp.status_code, stats.count
+
+    def get(self, url):
+        return self._send("GET", url)
+
+    def post(self, url, data=None):
+        return self._send("POST", url, data)
+
+
+class HTTPDriver:
+    """Sends real HTTP requests to a running server at `base_url`.
+
+    Logs in through the login form (generated users' password is
+    "password") and reuses that session's CSRF token for every form post.
+    Redirects aren't followed. SQL counts come from the X-DB-Queries header
+    when the server has SQL_STATS_ENABLED.
+    """
+
+    def __init__(self, base_url, username, password="password"):
+        self.base_url = base_url.rstrip("/")
+        self.cookies = CookieJar()
+        self.opener = build_opener(
+            HTTPCookieProcessor(self.cookies), NoRedirects())
+
+        self.csrf_token = self._csrf_token("/login")
+        status, _ = self.post(
+            "/login", {"username": username, "password": password})
+
+        # A failed login shows the form again (200) rather than redirecting
+        logged_in = status == 302 and any(
+            cookie.name == SESSION_COOKIE for cookie in self.cookies)
+
+        if not logged_in:
+            raise RuntimeError(f"Could not log in as {username}")
+
+    def _csrf_token(self, url):
+        with self.opener.open(self.base_url + url) as resp:
+            match = CSRF_TOKEN_PATTERN.search(resp.read().decode())
+
+        return match.group(1) if match else ""
+
+    def _send(self, url, body=None):
+        try:
+            with self.opener.open(self.base_url + url, body) as resp:
+                resp.read()
+                return resp.status, self._statements(resp)
+        except HTTPError as error:
+            with error:
+                return error.code, self._statements(error)
+
+    @staticmethod
+    def _statements(resp):
+        queries = resp.headers.get("X-DB-Queries")
+        return int(queries) if queries is not None else None
+
+    def get(self, url):
+        return self._send(url)
+
+    def post(self, url, data=None):
+        data = dict(data or {}, csrf_token=self.csrf_token)
+        return self._send(url, urlencode(data).encode())
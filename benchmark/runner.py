@@ -0,0 +1,266 @@
+"""Seed a benchmark dataset, drive a weighted request mix, summarize it."""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from benchmark.drivers import HTTPDriver, TestClientDriver
+from models import db, User, Message, Follow, Like
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative weight of each route in the request mix
+ROUTE_MIX = {
+    "home": 35,
+    "profile": 15,
+    "likes": 10,
+    "search": 10,
+    "like": 15,
+    "follow": 15,
+}
+
+
+def seed_dataset(users, messages, follows, likes, seed):
+    """Generate a dataset of the given size and load it, replacing every
+    table in the database."""
+
+    from loader import load_dataset
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(ROOT, "generator", "create_csvs.py"),
+                "--users", str(users),
+                "--messages", str(messages),
+                "--follows", str(follows),
+                "--likes", str(likes),
+                "--seed", str(seed),
+                "--end", "2023-01-01",
+                "--out", directory,
+            ],
+            check=True,
+        )
+
+        db.drop_all()
+        db.create_all()
+        load_dataset(directory)
+
+
+class Session:
+    """One simulated user: a driver plus what they follow and like, so
+    follow/like requests toggle real state instead of failing."""
+
+    def __init__(self, driver, user_id, following, liked):
+        self.driver = driver
+        self.user_id = user_id
+        self.following = following
+        self.liked = liked
+
+
+def open_sessions(app, count, base_url, rng):
+    """Log in `count` distinct random users."""
+
+    user_ids = db.session.scalars(select(User.id)).all()
+    chosen = rng.sample(user_ids, min(count, len(user_ids)))
+    sessions = []
+
+    for user_id in chosen:
+        user = db.session.get(User, user_id)
+        following = set(db.session.scalars(
+            select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == user_id)))
+        liked = set(db.session.scalars(
+            select(Like.message_id).where(Like.user_id == user_id)))
+
+        if base_url:
+            driver = HTTPDriver(base_url, user.username)
+        else:
+            driver = TestClientDriver(app, user_id)
+
+        sessions.append(Session(driver, user_id, following, liked))
+
+    return sessions
+
+
+def dataset_shape():
+    """Return the id ranges and search terms requests are drawn from."""
+
+    max_user_id = db.session.scalar(select(func.max(User.id))) or 0
+    max_message_id = db.session.scalar(select(func.max(Message.id))) or 0
+    usernames = db.session.scalars(select(User.username).limit(200)).all()
+
+    return dict(
+        max_user_id=max_user_id,
+        max_message_id=max_message_id,
+        search_terms=sorted({name[:3] for name in usernames}) or ["a"],
+    )
+
+
+def send(route, session, shape, rng):
+    """Send one request for `route`; return (status, sql_statements)."""
+
+    driver = session.driver
+
+    if route == "home":
+        return driver.get("/")
+
+    if route == "profile":
+        return driver.get(f"/users/{rng.randint(1, shape['max_user_id'])}")
+
+    if route == "likes":
+        return driver.get(
+            f"/users/{rng.randint(1, shape['max_user_id'])}/likes")
+
+    if route == "search":
+        return driver.get(f"/users?q={rng.choice(shape['search_terms'])}")
+
+    if route == "like":
+        message_id = rng.randint(1, shape['max_message_id'])
+        action = "unlike" if message_id in session.liked else "like"
+        session.liked ^= {message_id}
+        return driver.post(
+            f"/messages/{message_id}/{action}", {"requesting_page": "/"})
+
+    if route == "follow":
+        # Anyone but ourselves
+        user_id = rng.randint(1, shape['max_user_id'] - 1)
+        if user_id >= session.user_id:
+            user_id += 1
+        action = (
+            "stop-following" if user_id in session.following else "follow")
+        session.following ^= {user_id}
+        return driver.post(f"/users/{action}/{user_id}")
+
+    raise ValueError(f"Unknown route {route}")
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """Turn per-request samples into per-route and overall statistics.
+
+    samples: list of (route, seconds, status, sql_statements)
+    """
+
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+
+    routes = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(seconds * 1000 for _, seconds, _, _ in route_samples)
+        statements = [count for *_, count in route_samples if count is not None]
+
+        routes[route] = dict(
+            requests=len(route_samples),
+            errors=sum(1 for _, _, status, _ in route_samples if status >= 500),
+            requests_per_sec=round(len(route_samples) / elapsed, 1),
+            mean_ms=round(sum(latencies) / len(latencies), 2),
+            p50_ms=round(percentile(latencies, 0.50), 2),
+            p95_ms=round(percentile(latencies, 0.95), 2),
+            p99_ms=round(percentile(latencies, 0.99), 2),
+            sql_statements_mean=(
+                round(sum(statements) / len(statements), 2)
+                if statements else None),
+            sql_statements_max=max(statements) if statements else None,
+        )
+
+    return dict(
+        requests=len(samples),
+        errors=sum(route["errors"] for route in routes.values()),
+        elapsed_sec=round(elapsed, 2),
+        requests_per_sec=round(len(samples) / elapsed, 1) if elapsed else None,
+        routes=routes,
+    )
+
+
+def run(app, requests, concurrency, warmup=50, base_url=None, seed=0,
+        mix=None):
+    """Drive `requests` weighted requests from `concurrency` threads.
+
+    Returns the summary from summarize().
+    """
+
+    rng = random.Random(seed)
+    mix = mix or ROUTE_MIX
+    shape = dataset_shape()
+    sessions = open_sessions(app, concurrency, base_url, rng)
+    routes, weights = zip(*mix.items())
+
+    def worker(index, count, record):
+        session = sessions[index]
+        worker_rng = random.Random(seed * 1000 + index)
+        samples = []
+
+        with app.app_context():
+            for route in worker_rng.choices(routes, weights, k=count):
+                started = time.perf_counter()
+                status, statements = send(route, session, shape, worker_rng)
+                seconds = time.perf_counter() - started
+
+                if record:
+                    samples.append((route, seconds, status, statements))
+
+        return samples
+
+    def run_phase(total, record):
+        per_worker = [
+            total // len(sessions) + (1 if i < total % len(sessions) else 0)
+            for i in range(len(sessions))
+        ]
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            futures = [
+                executor.submit(worker, i, count, record)
+                for i, count in enumerate(per_worker)
+            ]
+            return [sample for f in futures for sample in f.result()]
+
+    run_phase(warmup, record=False)
+
+    started = time.perf_counter()
+    samples = run_phase(requests, record=True)
+    elapsed = time.perf_counter() - started
+
+    return summarize(samples, elapsed)
+
+
+def git_revision():
+    """The current commit, if this is a git checkout."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args):
+    """Describe the run, stored alongside the results."""
+
+    return dict(
+        started_at=datetime.now(timezone.utc).isoformat(),
+        git_revision=git_revision(),
+        database=db.engine.dialect.name,
+        driver="http" if args.url else "test-client",
+        options=vars(args),
+    )
@@ -0,0 +1,77 @@
+"""How long a freshly started worker takes to serve its first request.
+
+Each run starts a new Python process, as a gunicorn worker restart (or a
+boot without preloading) does, and times:
+
+- import_ms: importing the app module
+- create_app_ms: create_app()
+- first_request_ms / second_request_ms: GET `path` twice through the test
+  client; the gap between them is the work left for the first request
+- process_ms: the whole run, interpreter start to exit
+
+    python -m benchmark --startup --runs 10
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmark.runner import ROOT, percentile
+
+STEPS = ("import_ms", "create_app_ms", "first_request_ms",
+         "second_request_ms", "process_ms")
+
+# Runs in the child process; prints its timings as JSON
+SCRIPT = """
+import json, sys, time
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+client = application.test_client()
+client.get(sys.argv[1])
+first = time.perf_counter()
+client.get(sys.argv[1])
+second = time.perf_counter()
+
+print(json.dumps(dict(
+    import_ms=(imported - started) * 1000,
+    create_app_ms=(created - imported) * 1000,
+    first_request_ms=(first - created) * 1000,
+    second_request_ms=(second - first) * 1000,
+)))
+"""
+
+
+def run_once(path):
+    """Time one fresh process; return its timings."""
+
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT, path],
+        cwd=ROOT, env=os.environ, capture_output=True, text=True, check=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    return dict(json.loads(result.stdout), process_ms=elapsed * 1000)
+
+
+def run(runs=5, path="/login"):
+    """Time `runs` fresh processes; return percentiles for each step."""
+
+    samples = [run_once(path) for _ in range(runs)]
+    results = dict(runs=runs, path=path, steps={})
+
+    for step in STEPS:
+        values = sorted(sample[step] for sample in samples)
+        results["steps"][step] = dict(
+            p50_ms=round(percentile(values, 0.50), 1),
+            min_ms=round(values[0], 1),
+            max_ms=round(values[-1], 1),
+        )
+
+    return results
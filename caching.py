@@ -0,0 +1,128 @@
+"""Small in-process caches for Warbler.
+
+Each gunicorn worker keeps its own copy, so anything cached here must be
+safe to serve slightly stale until it expires or is invalidated locally.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache with optional expiry.
+
+    - maxsize: most entries kept before the oldest-used is evicted
+    - ttl: seconds an entry stays valid (None to never expire)
+    - maxbytes: cap on the total `size` given to set() (None for no cap)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` if missing or
+        expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, size = entry
+
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        """Cache `value` under `key`, evicting least recently used entries
+        while the cache is over maxsize or maxbytes.
+
+        `size` is the value's cost towards maxbytes, e.g. its length.
+        """
+
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else None)
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while self._entries and (
+                    len(self._entries) > self.maxsize or
+                    (self.maxbytes is not None and
+                     self._bytes > self.maxbytes)):
+                self._remove(next(iter(self._entries)))
+
+    def update(self, key, func):
+        """Replace the cached value for `key` with `func(value)`, keeping
+        its expiry and size. Does nothing if `key` is missing or expired.
+
+        Runs `func` under the cache's lock, so concurrent updates to one
+        key can't lose each other's changes; keep it quick.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return
+
+            value, expires_at, size = entry
+
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                return
+
+            self._entries[key] = (func(value), expires_at, size)
+
+    def _remove(self, key):
+        """Drop `key`, keeping the byte count right. Call with the lock."""
+
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def delete(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the cache's size and hit counts."""
+
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                bytes=self._bytes,
+                hits=self.hits,
+                misses=self.misses,
+            )
@@ -0,0 +1,103 @@
+"""Settings for each environment Warbler runs in.
+
+create_app() picks one by name: the argument it's given, else
+WARBLER_ENV, else "development" when FLASK_DEBUG is on and "production"
+otherwise. Values come from the environment when the config is built,
+not when this module is imported.
+
+- development: debug toolbar, DATABASE_URL
+- testing: TEST_DATABASE_URL (default postgresql:///warbler_test), no
+  CSRF checks, fast password hashing, SECRET_KEY optional
+- production: templates compiled at startup, so no request pays for it
+"""
+
+import os
+
+import database
+import replicas
+
+
+class Config:
+    """Settings shared by every environment."""
+
+    SQLALCHEMY_ECHO = False
+    DEBUG_TB_ENABLED = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Compile every template in create_app() rather than on first use
+    WARM_UP = False
+
+    def __init__(self, environ=os.environ):
+        self.SECRET_KEY = self.secret_key(environ)
+        self.SQLALCHEMY_DATABASE_URI = self.database_url(environ)
+        self.SQLALCHEMY_ENGINE_OPTIONS = database.engine_options(
+            self.SQLALCHEMY_DATABASE_URI, environ)
+
+        if environ.get('DATABASE_REPLICA_URL'):
+            self.SQLALCHEMY_BINDS = replicas.replica_bind(
+                environ['DATABASE_REPLICA_URL'],
+                database.engine_options(
+                    environ['DATABASE_REPLICA_URL'], environ),
+            )
+
+        self.REPLICA_PIN_SECONDS = float(
+            environ.get('REPLICA_PIN_SECONDS', 5))
+        self.BCRYPT_LOG_ROUNDS = int(environ.get('BCRYPT_LOG_ROUNDS', 12))
+        self.PASSWORD_HASH_WORKERS = int(
+            environ.get('PASSWORD_HASH_WORKERS', 2))
+        # "materialized" or "merge" (see timelines.py)
+        self.TIMELINE_ENGINE = environ.get('TIMELINE_ENGINE', 'materialized')
+        # "postgres" or "memory"; by default, whichever suits the database
+        # (see search.py)
+        self.SEARCH_BACKEND = environ.get('SEARCH_BACKEND')
+        self.STATS_ENABLED = environ.get('STATS_ENABLED') == 'true'
+        self.SQL_STATS_ENABLED = environ.get('SQL_STATS_ENABLED') == 'true'
+
+    def secret_key(self, environ):
+        return environ['SECRET_KEY']
+
+    def database_url(self, environ):
+        return environ['DATABASE_URL']
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TB_ENABLED = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+    def __init__(self, environ=os.environ):
+        super().__init__(environ)
+        self.BCRYPT_LOG_ROUNDS = int(environ.get('BCRYPT_LOG_ROUNDS', 4))
+
+    def secret_key(self, environ):
+        return environ.get('SECRET_KEY', 'testing')
+
+    def database_url(self, environ):
+        return environ.get(
+            'TEST_DATABASE_URL', 'postgresql:///warbler_test')
+
+
+class ProductionConfig(Config):
+    WARM_UP = True
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def config_name(environ=os.environ):
+    """The environment to configure for when none is given."""
+
+    if 'WARBLER_ENV' in environ:
+        return environ['WARBLER_ENV']
+
+    if environ.get('FLASK_DEBUG', '').lower() in ('1', 'true'):
+        return 'development'
+
+    return 'production'
@@ -0,0 +1,91 @@
+"""Cheap resolution of the logged-in user for each request.
+
+Most requests only need the current user's id and the fields shown in the
+navbar, so those are cached per worker. The full User row is loaded only
+when a handler or template touches anything else.
+"""
+
+from sqlalchemy import select
+
+from caching import LRUCache
+from models import db, User
+
+DISPLAY_FIELDS = ('id', 'username', 'image_url', 'header_image_url')
+
+# Profile edits in another worker show up here within CACHE_TTL seconds
+CACHE_SIZE = 10_000
+CACHE_TTL = 30
+
+display_fields_cache = LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+class AccountGone(Exception):
+    """The logged-in user was deactivated or deleted since their display
+    fields were cached (possibly by another worker)."""
+
+
+class CurrentUser:
+    """The logged-in user's display fields, standing in for a User.
+
+    Reading any other attribute loads the User row (once per request) and
+    delegates to it, so handlers can treat this like the ORM object.
+    """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+        self._user = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def load(self):
+        """Return the full User row for this user.
+
+        Raises AccountGone, and forgets the cached fields, if the account
+        has been deactivated or purged.
+        """
+
+        if self._user is None:
+            user = db.session.get(User, self.id)
+
+            if user is None or user.deactivated_at is not None:
+                forget_current_user(self.id)
+                raise AccountGone(self.id)
+
+            self._user = user
+
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+def get_current_user(user_id):
+    """Return a CurrentUser for `user_id`, or None if there is no such user
+    (or their account has been deactivated).
+
+    Hits the database only when the display fields aren't cached.
+    """
+
+    fields = display_fields_cache.get(user_id)
+
+    if fields is None:
+        row = db.session.execute(
+            select(*(getattr(User, name) for name in DISPLAY_FIELDS))
+            .where(User.id == user_id)
+            .where(User.deactivated_at.is_(None))
+        ).one_or_none()
+
+        if row is None:
+            return None
+
+        fields = row._asdict()
+        display_fields_cache.set(user_id, fields)
+
+    return CurrentUser(fields)
+
+
+def forget_current_user(user_id):
+    """Invalidate the cached display fields for `user_id`."""
+
+    display_fields_cache.delete(user_id)
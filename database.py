@@ -0,0 +1,136 @@
+"""Database engine and connection pool configuration.
+
+The pool is sized to the worker model: each gunicorn worker process has
+its own pool, and a worker running WEB_THREADS threads needs at most one
+connection per thread, plus a little overflow for background work. So the
+database must accept about
+
+    WEB_CONCURRENCY * (WEB_THREADS + DB_MAX_OVERFLOW)
+
+connections. Environment variables (all optional):
+
+- WEB_THREADS: request threads per worker (default 1)
+- DB_MAX_OVERFLOW: extra connections beyond that (default 2)
+- DB_POOL_TIMEOUT: seconds to wait for a free connection (default 10)
+- DB_POOL_RECYCLE: seconds before a connection is replaced (default 1800)
+- DB_STATEMENT_TIMEOUT_MS: Postgres statement_timeout (default: none; the
+  gunicorn config sets one for web workers, so CLI commands and bulk
+  loads aren't cut short)
+
+Pool checkouts and how long they waited are counted; see pool_stats().
+"""
+
+import os
+import time
+from threading import Lock
+
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that counts checkouts, waits and timeouts.
+
+    A checkout waits when every pooled connection is in use and the
+    overflow is exhausted; steady waits mean the pool is too small for the
+    load (or connections are held too long).
+    """
+
+    # A checkout slower than this counts as having waited for a connection
+    WAIT_THRESHOLD = 0.001
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def recreate(self):
+        # Keep the counters when the pool is rebuilt (e.g. after a
+        # disconnect), so totals aren't lost
+        pool = super().recreate()
+        pool._stats_lock = self._stats_lock
+        for name in ('checkouts', 'waits', 'timeouts', 'wait_seconds',
+                     'max_wait_seconds'):
+            setattr(pool, name, getattr(self, name))
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+
+        try:
+            return super()._do_get()
+
+        except PoolTimeout:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+        finally:
+            waited = time.perf_counter() - started
+
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                if waited > self.WAIT_THRESHOLD:
+                    self.waits += 1
+
+
+def engine_options(database_url, environ=os.environ):
+    """Return SQLALCHEMY_ENGINE_OPTIONS for `database_url`.
+
+    Pool sizing and timeouts only apply to Postgres; other databases keep
+    SQLAlchemy's defaults.
+    """
+
+    if not database_url.startswith(('postgresql', 'postgres')):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('WEB_THREADS', 1)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 2)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+    statement_timeout = environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={int(statement_timeout)}',
+        }
+
+    return options
+
+
+def pool_stats(engine):
+    """Return live connection pool numbers for `engine`."""
+
+    pool = engine.pool
+    stats = dict(pool=type(pool).__name__)
+
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+        )
+
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            stats.update(
+                checkouts=pool.checkouts,
+                waits=pool.waits,
+                timeouts=pool.timeouts,
+                wait_ms_total=round(pool.wait_seconds * 1000, 1),
+                wait_ms_max=round(pool.max_wait_seconds * 1000, 1),
+            )
+
+    return stats
@@ -0,0 +1,93 @@
+"""Cache of rendered message list items.
+
+Timelines, profiles and likes pages render the same `<li>` for a message
+over and over. The markup only depends on the message, its author's
+profile and whether the viewer likes it (or wrote it), so it is rendered
+once and reused:
+
+    {% for message in messages %}
+      {{ render_message(message) }}
+    {% endfor %}
+
+Entries are keyed by (message id, liked, own) and store the author id,
+timestamp and author's profile_version they were rendered with. A hit
+only counts if all three still match, so bumping the version makes every
+entry for that author stale in every worker, and a message id reused
+after a delete (SQLite reuses them) never shows another message's
+fragment. Per-request values (the CSRF
+token and the page to return to) are cached as placeholders and filled in
+on the way out.
+"""
+
+from flask import g, render_template, request
+from markupsafe import Markup
+
+from caching import LRUCache
+
+# Each gunicorn worker holds up to this many fragments / characters
+CACHE_SIZE = 20_000
+CACHE_BYTES = 16 * 1024 * 1024
+
+# Any text a user can write is HTML-escaped, so it can't contain these
+CSRF_PLACEHOLDER = Markup("<!--csrf-field-->")
+PAGE_PLACEHOLDER = Markup("<!--requesting-page-->")
+
+message_fragments = LRUCache(maxsize=CACHE_SIZE, maxbytes=CACHE_BYTES)
+
+
+def render_message(message):
+    """Return the list item for `message` as seen by the current user."""
+
+    liked = message.id in g.liked_ids
+    own = message.user_id == g.user.id
+    key = (message.id, liked, own)
+    rendered_for = (
+        message.user_id, message.timestamp, message.user.profile_version)
+
+    cached = message_fragments.get(key)
+
+    if cached is not None and cached[0] == rendered_for:
+        html = cached[1]
+
+    else:
+        html = render_template(
+            'messages/item.html',
+            message=message,
+            csrf_field=CSRF_PLACEHOLDER,
+            requesting_page=PAGE_PLACEHOLDER,
+        )
+        message_fragments.set(key, (rendered_for, html), size=len(html))
+
+    if not own:
+        html = (html
+                .replace(CSRF_PLACEHOLDER, _csrf_field())
+                .replace(PAGE_PLACEHOLDER, Markup.escape(request.url)))
+
+    return Markup(html)
+
+
+def _csrf_field():
+    """This request's hidden CSRF input, rendered once per page."""
+
+    if "_csrf_field" not in g:
+        g._csrf_field = g.csrf_form.hidden_tag()
+
+    return g._csrf_field
+
+
+def forget_message(message_id):
+    """Drop every cached fragment for `message_id`."""
+
+    for liked in (True, False):
+        for own in (True, False):
+            message_fragments.delete((message_id, liked, own))
+
+
+def init_app(app):
+    """Make render_message() available to `app`'s templates."""
+
+    app.add_template_global(render_message)
+
+    @app.before_request
+    def reset_csrf_field():
+        g.pop("_csrf_field", None)
@@ -3,33 +3,40 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Runs fully offline and streams every row straight to disk, so it can make
+datasets with millions of users and messages. Who posts, who gets followed
+and which messages get liked all follow power-law distributions, like a
+real social network. The same --seed always produces the same files.
+
+    python generator/create_csvs.py --users 300 --messages 1000 \\
+        --follows 5000 --likes 3000 --seed 1 --end 2023-02-01
 """
 
+import argparse
+import csv
 import os
-from dotenv import load_dotenv
+import random
+from datetime import datetime
 
-import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
 from faker import Faker
-from helpers import get_random_datetime
-
-load_dotenv()
-
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+from helpers import get_random_datetime, split_evenly, PowerLawSampler
 
 MAX_WARBLER_LENGTH = 140
+MAX_USERNAME_BASE_LENGTH = 20
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 3000
 
-fake = Faker()
+# Hash of "password", so every generated user can log in
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
 # Generate random profile image URLs to use for users
 
@@ -39,51 +46,146 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
+# Header images, fixed so generation needs no network access
+
+HEADER_IMAGE_IDS = [
+    "1573996987033-47fd3a4ca35e", "1574001412492-7555e61a9b53",
+    "1575015642299-5b92fcbd0ba4", "1647598939382-5637f4eeb7b9",
+    "1653061853347-4fbf052530e9", "1668353064375-d3dcd3346d53",
+    "1669375957059-0cd563ba4a02", "1673844968943-694c71e94e93",
+    "1673950455470-d872dcec6eb1", "1674240568812-d7481f3699a7",
+    "1674318012388-141651b08a51", "1674394006641-b680753c502b",
+    "1674407728563-f30774195b0f", "1674420628423-bf7a338af32d",
+    "1674493310933-e681279e5664", "1674500021669-27da4b40772a",
+    "1674505681324-3ef7edf8415b", "1674530493752-719b5514a7f2",
+    "1674575496466-5119fd691bf4", "1674580351112-42fdbbae9c86",
+    "1674653743689-c8e507e3dee8", "1674653844677-b98dfbbc0ac5",
+    "1674673858080-fb524d0280a4", "1674690017732-63c3c5f8088c",
+    "1674754666443-696bc5b522f3", "1674754666581-4e6657392655",
+    "1674756142722-14266beb51d6", "1674824959440-09442ed75a8e",
+    "1674856320411-8c63716007d6",
+]
 
 header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
+    f"https://images.unsplash.com/photo-{photo_id}"
+    "?crop=entropy&cs=tinysrgb&fit=max&fm=jpg&q=80&w=1080"
+    for photo_id in HEADER_IMAGE_IDS
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def write_users(path, fake, num_users):
+    """Write `num_users` users with unique usernames and emails."""
+
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
+        users_writer.writeheader()
+
+        for i in range(num_users):
+            # The numeric suffix keeps names unique at any scale
+            username = f"{fake.user_name()[:MAX_USERNAME_BASE_LENGTH]}{i}"
+
+            users_writer.writerow(dict(
+                email=f"{username}@example.org",
+                username=username,
+                image_url=random.choice(image_urls),
+                password=PASSWORD,
+                bio=fake.sentence(),
+                header_image_url=random.choice(header_image_urls),
+                location=fake.city()[:30],
+            ))
+
+
+def write_messages(path, fake, num_users, num_messages, end):
+    """Write `num_messages` messages posted in the two years before `end`;
+    a few users write most of them."""
+
+    authors = PowerLawSampler(num_users)
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
+        messages_writer.writeheader()
+
+        for i in range(num_messages):
+            messages_writer.writerow(dict(
+                text=fake.paragraph()[:MAX_WARBLER_LENGTH],
+                timestamp=get_random_datetime(now=end),
+                user_id=authors(),
+            ))
+
+
+def write_follows(path, num_users, num_follows):
+    """Write about `num_follows` follows; a few users get most followers.
+
+    Follows are drawn per follower without ever building the full list of
+    possible pairs, so memory stays proportional to one user's follows.
+    """
+
+    followed = PowerLawSampler(num_users)
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
+        follows_writer.writeheader()
+
+        counts = split_evenly(num_follows, num_users)
+        for follower, count in enumerate(counts, start=1):
+            for followed_user in sorted(followed.distinct(count, follower)):
+                follows_writer.writerow(dict(
+                    user_being_followed_id=followed_user,
+                    user_following_id=follower,
+                ))
+
+
+def write_likes(path, num_users, num_messages, num_likes):
+    """Write about `num_likes` likes; a few messages get most of them."""
+
+    liked = PowerLawSampler(num_messages)
+
+    with open(path, 'w', newline='') as likes_csv:
+        likes_writer = csv.DictWriter(likes_csv, fieldnames=LIKES_CSV_HEADERS)
+        likes_writer.writeheader()
+
+        counts = split_evenly(num_likes, num_users)
+        for user_id, count in enumerate(counts, start=1):
+            for message_id in sorted(liked.distinct(count)):
+                likes_writer.writerow(dict(
+                    user_id=user_id,
+                    message_id=message_id,
+                ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler sample data as CSV files.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS)
+    parser.add_argument('--likes', type=int, default=NUM_LIKES)
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed; the same seed gives the same files")
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSV files to")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime.combine(datetime.today(), datetime.min.time()),
+                        help="newest message time (default: start of today)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    Faker.seed(args.seed)
+    fake = Faker()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    write_users(
+        os.path.join(args.out, 'users.csv'), fake, args.users)
+    write_messages(
+        os.path.join(args.out, 'messages.csv'), fake, args.users,
+        args.messages, args.end)
+    write_follows(
+        os.path.join(args.out, 'follows.csv'), args.users, args.follows)
+    write_likes(
+        os.path.join(args.out, 'likes.csv'), args.users, args.messages,
+        args.likes)
+
+
+if __name__ == '__main__':
+    main()
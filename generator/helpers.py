@@ -1,14 +1,96 @@
 """Support functions for CSV generation."""
 
 from datetime import datetime
-from random import uniform
+from math import floor, gcd
+from random import random, uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, now=None):
+    """Get a random datetime within the few years before `now` (default:
+    the current time)."""
 
-    now = datetime.now()
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
     random_timestamp = uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def split_evenly(total, parts):
+    """Yield how many of `total` items each of `parts` buckets gets, so
+    that the counts add up to exactly `total`."""
+
+    for i in range(parts):
+        yield (i + 1) * total // parts - i * total // parts
+
+
+class PowerLawSampler:
+    """Draw ids from 1..n where a few ids are very popular.
+
+    The id at popularity rank k is drawn with probability roughly
+    proportional to k ** -exponent (inverse-CDF sampling of a bounded
+    Pareto), so each draw is O(1) time and memory no matter how big n is.
+    Ranks are scattered over the ids with a fixed permutation so the
+    popular ids aren't simply the first ones.
+    """
+
+    def __init__(self, n, exponent=1.2):
+        if exponent == 1:
+            raise ValueError("exponent must not be 1")
+
+        self.n = n
+        self.exponent = exponent
+        self._span = (n + 1) ** (1 - exponent) - 1
+        self._stride = self._coprime_stride(n)
+
+    @staticmethod
+    def _coprime_stride(n):
+        """Pick a stride near n * 0.618 sharing no factor with n."""
+
+        stride = max(1, int(n * 0.6180339887))
+
+        while gcd(stride, n) != 1:
+            stride += 1
+
+        return stride
+
+    def rank(self):
+        """Draw a popularity rank in 0..n-1 (0 is the most popular)."""
+
+        u = random()
+        x = (self._span * u + 1) ** (1 / (1 - self.exponent))
+
+        return min(floor(x) - 1, self.n - 1)
+
+    def __call__(self):
+        """Draw an id in 1..n."""
+
+        return (self.rank() + 1) * self._stride % self.n + 1
+
+    def distinct(self, count, exclude=None):
+        """Draw `count` distinct ids, never returning `exclude`.
+
+        Uses rejection, so it only keeps the ids already drawn in memory.
+        `count` is capped at the number of ids available.
+        """
+
+        available = self.n - (1 if exclude is not None else 0)
+        count = min(count, available)
+        chosen = set()
+
+        # Heavy tails make late draws collide a lot; fall back to a linear
+        # sweep rather than spinning when almost every id is wanted
+        attempts = 0
+        while len(chosen) < count and attempts < count * 20:
+            attempts += 1
+            drawn = self()
+            if drawn != exclude:
+                chosen.add(drawn)
+
+        candidate = 1
+        while len(chosen) < count:
+            if candidate != exclude:
+                chosen.add(candidate)
+            candidate += 1
+
+        return chosen
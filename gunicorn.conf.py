@@ -0,0 +1,63 @@
+"""gunicorn settings for Warbler: gunicorn
+
+Workers and threads come from WEB_CONCURRENCY and WEB_THREADS; database.py
+reads the same variables to size each worker's connection pool.
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+workers = int(
+    os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
+
+wsgi_app = 'app:create_app()'
+
+# Build the app (imports, config, compiled templates) once in the master;
+# workers, including ones restarted later, start as a fork of it instead
+# of repeating that work. create_app() opens no database connections, so
+# none are shared across the fork. Set GUNICORN_PRELOAD=false to have
+# `kill -HUP` pick up code changes.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true') == 'true'
+
+# Kill requests the database spends too long on before gunicorn's own
+# worker timeout does
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+raw_env = [
+    'DB_STATEMENT_TIMEOUT_MS=' +
+    os.environ.get('DB_STATEMENT_TIMEOUT_MS', str(timeout * 1000 // 2)),
+]
+
+# With JOBS_IN_GUNICORN=true the master also runs a background job worker
+# (`flask worker`, see jobs.py) for as long as it runs. It's a separate
+# process rather than threads in the master, whose state every web worker
+# would inherit when forked.
+JOBS_IN_GUNICORN = os.environ.get('JOBS_IN_GUNICORN') == 'true'
+JOB_THREADS = os.environ.get('JOB_THREADS', '1')
+
+_job_worker = None
+
+
+def when_ready(server):
+    global _job_worker
+
+    if JOBS_IN_GUNICORN:
+        # raw_env is in os.environ by now; jobs like purge_user run for
+        # longer than a web request may, so leave the statement timeout
+        # out of theirs
+        env = {
+            name: value for name, value in os.environ.items()
+            if name != 'DB_STATEMENT_TIMEOUT_MS'
+        }
+        _job_worker = subprocess.Popen([
+            sys.executable, '-m', 'flask', 'worker', '--threads', JOB_THREADS,
+        ], env=env)
+        server.log.info("Started job worker (pid: %s)", _job_worker.pid)
+
+
+def on_exit(server):
+    if _job_worker is not None:
+        _job_worker.terminate()
+        _job_worker.wait()
@@ -0,0 +1,160 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashes run on a small per-worker thread
+pool instead of however many request threads happen to be logging in.
+At most PASSWORD_HASH_WORKERS hashes run at once and at most
+PASSWORD_HASH_QUEUE more wait for a turn; beyond that, HashingBusy is
+raised so a login spike can't tie up every request thread.
+
+Config (read from the Flask app when used):
+
+- BCRYPT_LOG_ROUNDS: bcrypt work factor for new hashes (default 12);
+  existing hashes with another factor are rehashed on the next login
+- PASSWORD_HASH_WORKERS: hashes run concurrently (default 2)
+- PASSWORD_HASH_QUEUE: hashes allowed to wait for a worker (default 16)
+- PASSWORD_HASH_TIMEOUT: seconds to wait for a free slot (default 5)
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from flask import current_app
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 16
+DEFAULT_TIMEOUT = 5
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool and keeps simple metrics."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._executor = None
+        self._slots = None
+        self._metrics = dict(
+            hashed=0,
+            checked=0,
+            rehashed=0,
+            rejected=0,
+            in_flight=0,
+            hash_seconds=0.0,
+            wait_seconds=0.0,
+        )
+
+    def _pool(self):
+        """Return (executor, slots), creating them on first use.
+
+        Created lazily so each gunicorn worker gets its own threads after
+        forking.
+        """
+
+        with self._lock:
+            if self._executor is None:
+                config = current_app.config
+                workers = config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+                queue = config.get('PASSWORD_HASH_QUEUE', DEFAULT_QUEUE)
+
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers,
+                    thread_name_prefix='password-hash',
+                )
+                self._slots = BoundedSemaphore(workers + queue)
+
+            return self._executor, self._slots
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._metrics[name] += delta
+
+    def _run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for its result."""
+
+        executor, slots = self._pool()
+        timeout = current_app.config.get(
+            'PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT)
+
+        if not slots.acquire(timeout=timeout):
+            self._count(rejected=1)
+            raise HashingBusy("Too many password hashes in progress")
+
+        self._count(in_flight=1)
+        queued_at = time.perf_counter()
+
+        def timed():
+            started_at = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished_at = time.perf_counter()
+                self._count(
+                    wait_seconds=started_at - queued_at,
+                    hash_seconds=finished_at - started_at,
+                )
+
+        try:
+            return executor.submit(timed).result()
+        finally:
+            self._count(in_flight=-1)
+            slots.release()
+
+    @staticmethod
+    def log_rounds():
+        """The configured bcrypt work factor."""
+
+        return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` as a string."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        salt = bcrypt.gensalt(rounds=self.log_rounds())
+        hashed = self._run(bcrypt.hashpw, password.encode('UTF-8'), salt)
+        self._count(hashed=1)
+
+        return hashed.decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Does `password` match the bcrypt hash `hashed`?"""
+
+        if not password:
+            return False
+
+        self._count(checked=1)
+        return self._run(
+            bcrypt.checkpw,
+            password.encode('UTF-8'),
+            hashed.encode('UTF-8'),
+        )
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than configured?"""
+
+        # bcrypt hashes look like $2b$<rounds>$<salt+hash>
+        rounds = int(hashed.split('$')[2])
+        return rounds != self.log_rounds()
+
+    def rehash(self, password):
+        """Hash `password` again with the configured work factor."""
+
+        self._count(rehashed=1)
+        return self.hash(password)
+
+    def stats(self):
+        """Return a snapshot of the hashing metrics for this worker."""
+
+        with self._lock:
+            return dict(self._metrics)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,151 @@
+"""Per-request SQL statistics and query budgets.
+
+Every SQL statement run through SQLAlchemy is timed. While a request is
+being handled, its statement count, total database time and slowest
+statement are collected; with SQL_STATS_ENABLED set they are sent back
+as response headers and logged:
+
+    X-DB-Queries: 4
+    X-DB-Time-Ms: 3.2
+    X-DB-Slowest-Ms: 1.9
+
+Tests can use count_queries() or query_budget() to see or cap how many
+statements a block of code runs.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryStats:
+    """Statements seen while collecting, with their timings."""
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.statements = [] if keep_statements else None
+
+    def __len__(self):
+        return self.count
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+def _collectors():
+    """The QueryStats currently collecting on this thread."""
+
+    if not hasattr(_local, "collectors"):
+        _local.collectors = []
+
+    return _local.collectors
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, not the pooled
+    # connection, so a statement that fails takes its start time with it.
+    # A context can run nested statements (sequences), hence a stack.
+    if not hasattr(context, "_query_started_at"):
+        context._query_started_at = []
+
+    context._query_started_at.append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._query_started_at.pop()
+
+    for stats in _collectors():
+        stats.record(statement, seconds)
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run on this thread inside the block.
+
+    Yields a QueryStats; its `statements` lists the SQL text.
+    """
+
+    stats = QueryStats(keep_statements=True)
+    collectors = _collectors()
+    collectors.append(stats)
+
+    try:
+        yield stats
+    finally:
+        collectors.remove(stats)
+
+
+@contextmanager
+def query_budget(budget):
+    """Fail with AssertionError if the block runs more than `budget` SQL
+    statements."""
+
+    with count_queries() as stats:
+        yield stats
+
+    if stats.count > budget:
+        statements = "\n\n".join(stats.statements)
+        raise AssertionError(
+            f"Ran {stats.count} SQL statements, budget is {budget}:\n\n"
+            f"{statements}"
+        )
+
+
+def init_app(app):
+    """Collect SQL statistics for each request handled by `app`."""
+
+    app.config.setdefault("SQL_STATS_ENABLED", False)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        _collectors().append(g.query_stats)
+
+    @app.after_request
+    def report_query_stats(response):
+        if app.config["SQL_STATS_ENABLED"] and "query_stats" in g:
+            stats = g.query_stats
+
+            response.headers["X-DB-Queries"] = str(stats.count)
+            response.headers["X-DB-Time-Ms"] = (
+                f"{stats.total_seconds * 1000:.1f}")
+            response.headers["X-DB-Slowest-Ms"] = (
+                f"{stats.slowest_seconds * 1000:.1f}")
+
+            app.logger.info(
+                "%s %s: %d queries in %.1fms, slowest %.1fms: %s",
+                response.status_code,
+                request.path,
+                stats.count,
+                stats.total_seconds * 1000,
+                stats.slowest_seconds * 1000,
+                " ".join((stats.slowest_statement or "").split()),
+            )
+
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(error=None):
+        stats = g.pop("query_stats", None)
+
+        if stats in _collectors():
+            _collectors().remove(stats)
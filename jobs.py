@@ -0,0 +1,291 @@
+"""A durable background job queue kept in the database.
+
+Views hand slow work to the queue instead of doing it while the user
+waits. A job is a row in the jobs table, so it is enqueued in the same
+transaction as the change that needs it and survives restarts; no broker
+is needed.
+
+    @jobs.task('purge_user', timeout=3600)
+    def purge_user(user_id):
+        ...
+
+    jobs.enqueue('purge_user', {'user_id': 5},
+                 idempotency_key='purge-user-5')
+    db.session.commit()
+
+Workers run them:
+
+    flask worker --threads 2
+
+(or set JOBS_IN_GUNICORN=true and gunicorn starts one alongside the web
+workers; see gunicorn.conf.py).
+
+- Idempotency keys: enqueueing a job whose key is already taken, by a
+  queued, running or finished job, does nothing.
+- Visibility timeouts: a worker owns a claimed job for its task's
+  `timeout` seconds. If the worker dies, the job is claimed again once
+  that passes, so tasks must be safe to run more than once.
+- Retries: a task that raises is tried again after RETRY_DELAY seconds,
+  doubling each time, until it has had `max_attempts` attempts; then the
+  job is marked failed with the error kept in last_error.
+"""
+
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from models import db, insert_ignoring_conflicts, Job
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Seconds before the first retry; doubles with each attempt, up to
+# MAX_RETRY_DELAY
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 3600
+
+# Seconds an idle worker thread sleeps between looking for jobs
+POLL_INTERVAL = 1.0
+
+# task name: (function, timeout in seconds)
+TASKS = {}
+
+
+def task(name, timeout=DEFAULT_TIMEOUT):
+    """Register the decorated function as the task `name`.
+
+    `timeout` is how long a run may take before the job is assumed lost
+    and handed to another worker. The function is returned unchanged, so
+    it can still be called directly.
+    """
+
+    def register(func):
+        TASKS[name] = (func, timeout)
+        return func
+
+    return register
+
+
+def enqueue(name, payload=None, idempotency_key=None, run_at=None,
+            max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Add a job running task `name` with keyword arguments `payload`.
+
+    The job is added to the current transaction, so it only runs if the
+    caller commits. Returns the new job's id, or None if a job with
+    `idempotency_key` already exists.
+    """
+
+    if name not in TASKS:
+        raise KeyError(f"No task named {name!r}")
+
+    now = datetime.utcnow()
+
+    statement = (
+        insert_ignoring_conflicts(Job, {
+            'task': name,
+            'payload': payload or {},
+            'idempotency_key': idempotency_key,
+            'status': Job.QUEUED,
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'run_at': run_at or now,
+            'created_at': now,
+        })
+        .returning(Job.id)
+    )
+
+    return db.session.scalar(statement)
+
+
+def claim(now=None):
+    """Take the next job that is due and commit the claim.
+
+    A job is due when it is queued and its run_at has passed, or when it
+    is running but its worker's lock expired. Returns the claimed Job, or
+    None if there is nothing to do.
+    """
+
+    now = now or datetime.utcnow()
+
+    # Workers on Postgres skip rows another worker is claiming; the
+    # guarded UPDATE below makes the claim safe where that isn't
+    # supported (SQLite)
+    candidate = db.session.execute(
+        select(Job.id, Job.task, Job.attempts)
+        .where(or_(
+            and_(Job.status == Job.QUEUED, Job.run_at <= now),
+            and_(Job.status == Job.RUNNING, Job.locked_until < now),
+        ))
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    timeout = TASKS.get(candidate.task, (None, DEFAULT_TIMEOUT))[1]
+
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == candidate.id, Job.attempts == candidate.attempts)
+        .values(
+            status=Job.RUNNING,
+            attempts=Job.attempts + 1,
+            locked_until=now + timedelta(seconds=timeout),
+        )
+    ).rowcount
+    db.session.commit()
+
+    if not claimed:
+        return None
+
+    return db.session.get(Job, candidate.id)
+
+
+def run(job):
+    """Run a claimed `job` and record how it went.
+
+    Returns True if the task succeeded.
+    """
+
+    func = TASKS.get(job.task, (None,))[0]
+    attempts, max_attempts = job.attempts, job.max_attempts
+    payload = job.payload
+
+    # The claim this worker holds; if the job has since been claimed
+    # again (our lock expired), our result is stale and isn't recorded
+    owned = and_(Job.id == job.id, Job.attempts == attempts)
+
+    try:
+        if func is None:
+            raise KeyError(f"No task named {job.task!r}")
+
+        if attempts > max_attempts:
+            raise TimeoutError("Timed out on its last attempt")
+
+        func(**payload)
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+
+        if attempts >= max_attempts or func is None:
+            values = dict(status=Job.FAILED, finished_at=datetime.utcnow())
+        else:
+            delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+            values = dict(
+                status=Job.QUEUED,
+                run_at=datetime.utcnow() + timedelta(seconds=delay),
+            )
+
+        db.session.execute(
+            update(Job).where(owned).values(
+                locked_until=None, last_error=error, **values))
+        db.session.commit()
+
+        return False
+
+    db.session.execute(
+        update(Job).where(owned).values(
+            status=Job.DONE,
+            locked_until=None,
+            finished_at=datetime.utcnow(),
+        ))
+    db.session.commit()
+
+    return True
+
+
+def run_next():
+    """Claim and run one due job; return False if there was none."""
+
+    job = claim()
+
+    if job is None:
+        return False
+
+    run(job)
+
+    return True
+
+
+def run_pending():
+    """Run due jobs until there are none left; return how many ran.
+
+    Jobs retried with a delay aren't due yet, so this always finishes.
+    """
+
+    count = 0
+
+    while run_next():
+        count += 1
+
+    return count
+
+
+def delete_finished(before):
+    """Delete jobs that succeeded before `before`; return how many.
+
+    Their idempotency keys can then be used again.
+    """
+
+    count = db.session.execute(
+        delete(Job).where(Job.status == Job.DONE, Job.finished_at < before)
+    ).rowcount
+    db.session.commit()
+
+    return count
+
+
+class Worker:
+    """A pool of threads running jobs for `app` until stopped."""
+
+    def __init__(self, app, threads=1, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads."""
+
+        self._stopping.clear()
+
+        for number in range(self.threads):
+            thread = threading.Thread(
+                target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Ask the threads to stop once their current job is done."""
+
+        self._stopping.set()
+
+    def join(self):
+        """Wait for the threads to stop."""
+
+        while self._threads:
+            # Join in short waits so signal handlers still get to run
+            self._threads[0].join(timeout=1)
+            self._threads = [t for t in self._threads if t.is_alive()]
+
+    def _work(self):
+        # Each thread gets its own app context, and so its own session
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    ran = run_next()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Job worker error")
+                    ran = False
+
+                if not ran:
+                    self._stopping.wait(self.poll_interval)
@@ -0,0 +1,223 @@
+"""Stream CSV data into the Warbler database.
+
+Loads the CSVs made by generator/create_csvs.py in bounded chunks using the
+database's native bulk path (COPY on Postgres, multi-row executemany
+elsewhere). Secondary indexes are dropped for the load and rebuilt once at
+the end, serial sequences are reset, and tables that don't depend on each
+other load concurrently.
+
+Run it like:
+
+    python loader.py --dir generator --chunk-size 10000
+"""
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import inspect, text
+
+from models import db, User, TimelineEntry
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+# Tables in foreign-key order; tables in the same stage load concurrently
+LOAD_STAGES = [
+    ['users'],
+    ['messages', 'follows'],
+    ['likes'],
+]
+
+
+def report(name, rows, seconds):
+    """Print the row count and throughput for one load step."""
+
+    rate = rows / seconds if seconds else float('inf')
+    print(f"{name}: {rows:,} rows in {seconds:.1f}s ({rate:,.0f} rows/sec)")
+
+
+@contextmanager
+def indexes_dropped(connection, table):
+    """Drop `table`'s secondary indexes for the block, then rebuild them.
+
+    Only indexes declared on the model and present in the database are
+    touched; primary keys and unique constraints stay in place.
+    """
+
+    existing = {
+        index['name'] for index in inspect(connection).get_indexes(table.name)
+    }
+    dropped = [index for index in table.indexes if index.name in existing]
+
+    for index in dropped:
+        index.drop(connection)
+
+    yield
+
+    for index in dropped:
+        index.create(connection)
+
+
+def chunks(rows, size):
+    """Yield lists of up to `size` items from the iterable `rows`."""
+
+    rows = iter(rows)
+
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def converters(table, columns):
+    """Return functions turning CSV strings into values for `columns`."""
+
+    def convert(column):
+        python_type = table.c[column].type.python_type
+
+        if python_type is datetime:
+            return datetime.fromisoformat
+
+        return python_type
+
+    return {column: convert(column) for column in columns}
+
+
+def copy_csv(connection, table, path):
+    """Load `path` into `table` with Postgres COPY; return rows loaded."""
+
+    with open(path, newline='') as file:
+        columns = next(csv.reader(file))
+        file.seek(0)
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) "
+            "FROM STDIN WITH (FORMAT csv, HEADER true)",
+            file,
+        )
+
+        return cursor.rowcount
+
+
+def insert_csv(connection, table, path, chunk_size):
+    """Load `path` into `table` with chunked executemany; return rows
+    loaded."""
+
+    rows = 0
+
+    with open(path, newline='') as file:
+        reader = csv.DictReader(file)
+        convert = converters(table, reader.fieldnames)
+
+        for chunk in chunks(reader, chunk_size):
+            connection.execute(table.insert(), [
+                {column: convert[column](value)
+                 for column, value in row.items()}
+                for row in chunk
+            ])
+            rows += len(chunk)
+
+    return rows
+
+
+def reset_sequence(connection, table):
+    """Point `table`'s id sequence past the largest loaded id (Postgres)."""
+
+    if 'id' not in table.c:
+        return
+
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+    ))
+
+
+def load_table(engine, table, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream the CSV at `path` into `table` in its own transaction."""
+
+    started = time.perf_counter()
+    postgres = engine.dialect.name == 'postgresql'
+
+    with engine.begin() as connection:
+        with indexes_dropped(connection, table):
+            if postgres:
+                rows = copy_csv(connection, table, path)
+                reset_sequence(connection, table)
+            else:
+                rows = insert_csv(connection, table, path, chunk_size)
+
+    report(table.name, rows, time.perf_counter() - started)
+    return rows
+
+
+def load_dataset(directory, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Load every `<table>.csv` found in `directory`, then rebuild the
+    derived data (home timelines and counters)."""
+
+    engine = db.engine
+    tables = db.metadata.tables
+
+    # SQLite allows a single writer, so only fan out on real servers
+    workers = 1 if engine.dialect.name == 'sqlite' else 4
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for stage in LOAD_STAGES:
+            paths = {
+                name: os.path.join(directory, f"{name}.csv")
+                for name in stage
+            }
+            futures = [
+                executor.submit(
+                    load_table, engine, tables[name], path, chunk_size)
+                for name, path in paths.items()
+                if os.path.exists(path)
+            ]
+
+            for future in futures:
+                future.result()
+
+    step = time.perf_counter()
+    connection = db.session.connection()
+    with indexes_dropped(connection, TimelineEntry.__table__):
+        TimelineEntry.rebuild()
+    db.session.commit()
+    print(f"timelines rebuilt in {time.perf_counter() - step:.1f}s")
+
+    step = time.perf_counter()
+    User.repair_counters()
+    db.session.commit()
+    print(f"counters repaired in {time.perf_counter() - step:.1f}s")
+
+    print(f"total: {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--dir', default='generator', help="directory holding the CSVs")
+    parser.add_argument(
+        '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help="rows per insert batch (non-Postgres databases)")
+    parser.add_argument(
+        '--reset', action='store_true',
+        help="drop and recreate every table first")
+    args = parser.parse_args()
+
+    if args.reset:
+        db.drop_all()
+        db.create_all()
+
+    load_dataset(args.dir, args.chunk_size)
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app().app_context():
+        main()
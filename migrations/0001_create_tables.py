@@ -0,0 +1,12 @@
+"""Create any missing tables from the models.
+
+On an empty database this builds the whole current schema, indexes
+included, so every later migration finds nothing left to do. Databases
+created before migrations existed only get the tables they lack.
+"""
+
+from models import db
+
+
+def upgrade(connection):
+    db.metadata.create_all(connection)
@@ -0,0 +1,23 @@
+"""Add the denormalized follow, message and like counters, then fill them
+in from the follows, messages and likes tables."""
+
+from migrations import add_column
+from models import User
+
+COUNTERS = [
+    ('users', 'messages_count'),
+    ('users', 'following_count'),
+    ('users', 'followers_count'),
+    ('users', 'likes_count'),
+    ('messages', 'likes_count'),
+]
+
+
+def upgrade(connection):
+    added = [
+        add_column(connection, table, column, 'INTEGER NOT NULL DEFAULT 0')
+        for table, column in COUNTERS
+    ]
+
+    if any(added):
+        User.repair_counters()
@@ -0,0 +1,8 @@
+"""Add users.profile_version, which keys the rendered-message cache."""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(
+        connection, 'users', 'profile_version', 'INTEGER NOT NULL DEFAULT 0')
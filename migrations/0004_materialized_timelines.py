@@ -0,0 +1,15 @@
+"""Fill in home timelines for databases that had messages before
+timeline_entries existed (0001 creates the empty table)."""
+
+from sqlalchemy import exists, select
+
+from models import Message, TimelineEntry
+
+
+def upgrade(connection):
+    has_entries = connection.scalar(select(exists(TimelineEntry)))
+    has_messages = connection.scalar(select(exists(Message)))
+
+    if has_messages and not has_entries:
+        TimelineEntry.rebuild()
+        TimelineEntry.trim_all()
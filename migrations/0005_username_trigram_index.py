@@ -0,0 +1,14 @@
+"""Index usernames by trigram so user search doesn't scan the table.
+
+Postgres only; other databases skip it.
+"""
+
+from migrations import create_index
+from models import User
+
+
+def upgrade(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    create_index(connection, User, 'ix_users_username_trgm')
@@ -0,0 +1,17 @@
+"""Index the lookups the busiest pages make:
+
+- messages(user_id, timestamp DESC, id DESC): a user's newest messages
+- follows(user_following_id, ...): whom a user follows
+- likes(message_id): a message's likes
+
+`flask check-query-plans` confirms the queries use them.
+"""
+
+from migrations import create_index
+from models import Follow, Like, Message
+
+
+def upgrade(connection):
+    create_index(connection, Message, 'ix_messages_user_timestamp')
+    create_index(connection, Follow, 'ix_follows_user_following_id')
+    create_index(connection, Like, 'ix_likes_message_id')
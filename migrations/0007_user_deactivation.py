@@ -0,0 +1,8 @@
+"""Add users.deactivated_at, set when an account is deleted and cleared
+away with the user row once its purge finishes."""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'users', 'deactivated_at', 'TIMESTAMP')
@@ -0,0 +1,7 @@
+"""Create the jobs table for the background job queue (see jobs.py)."""
+
+from models import Job
+
+
+def upgrade(connection):
+    Job.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,16 @@
+"""Add messages.search_vector and its GIN index for message search.
+
+Postgres only; other databases skip it (see search.py). Adding a stored
+generated column rewrites the messages table, so run this at a quiet
+time on a large database.
+"""
+
+from models import SEARCH_VECTOR_DDL
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    for statement in SEARCH_VECTOR_DDL:
+        connection.exec_driver_sql(statement)
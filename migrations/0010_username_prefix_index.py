@@ -0,0 +1,17 @@
+"""Index lower(username) in byte order for prefix user searches.
+
+Serves the range, the sort and the keyset of the prefix tier of
+User.search(); `flask check-query-plans` confirms it. Created with IF NOT
+EXISTS, since SQLite doesn't reflect expression indexes for
+create_index() to check.
+"""
+
+from sqlalchemy.schema import CreateIndex
+
+from models import User
+
+
+def upgrade(connection):
+    index, = (i for i in User.__table__.indexes
+              if i.name == 'ix_users_username_key')
+    connection.execute(CreateIndex(index, if_not_exists=True))
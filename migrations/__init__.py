@@ -0,0 +1,132 @@
+"""Versioned, forward-only schema migrations.
+
+Each module in this package named like `0002_denormalized_counters.py` is
+one migration, applied in version order by its `upgrade(connection)`
+function. Applied versions are recorded in the schema_migrations table.
+
+    flask db-upgrade      apply any pending migrations
+    flask db-status       list migrations and whether each is applied
+
+Migrations must be idempotent: a fresh database built by
+`db.create_all()` already has the current schema, and `flask db-upgrade`
+on it should only record the versions. Use the helpers below (which check
+before changing anything) rather than raw DDL where possible.
+"""
+
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect
+
+from models import db
+
+VERSION_PATTERN = re.compile(r'^(\d{4})_(\w+)$')
+
+# Kept out of db.metadata so drop_all() / create_all() leave it alone
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations',
+    metadata,
+    Column('version', String(4), primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def available():
+    """Return (version, name, module) for every migration, in order."""
+
+    found = []
+
+    for module_info in pkgutil.iter_modules(__path__):
+        match = VERSION_PATTERN.match(module_info.name)
+
+        if match:
+            module = importlib.import_module(f'{__name__}.{module_info.name}')
+            found.append((match[1], match[2], module))
+
+    return sorted(found, key=lambda migration: migration[0])
+
+
+def applied_versions(connection):
+    """Return the set of versions already applied to this database."""
+
+    schema_migrations.create(connection, checkfirst=True)
+
+    return set(connection.scalars(schema_migrations.select().with_only_columns(
+        schema_migrations.c.version)))
+
+
+def pending():
+    """Return the (version, name, module) migrations not yet applied."""
+
+    applied = applied_versions(db.session.connection())
+
+    return [m for m in available() if m[0] not in applied]
+
+
+def upgrade():
+    """Apply every pending migration, each in its own transaction.
+
+    Returns the names of the migrations applied.
+    """
+
+    done = []
+
+    for version, name, module in pending():
+        try:
+            connection = db.session.connection()
+            module.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version,
+                name=name,
+                applied_at=datetime.utcnow(),
+            ))
+            db.session.commit()
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+        done.append(f'{version}_{name}')
+
+    return done
+
+
+##############################################################################
+# Helpers for migrations
+
+
+def has_column(connection, table_name, column_name):
+    """Does `table_name` have a column called `column_name`?"""
+
+    return any(
+        column['name'] == column_name
+        for column in inspect(connection).get_columns(table_name)
+    )
+
+
+def add_column(connection, table_name, column_name, definition):
+    """Add a column unless it already exists; return True if it was added.
+
+    `definition` is the SQL after the column name, e.g.
+    "INTEGER NOT NULL DEFAULT 0".
+    """
+
+    if has_column(connection, table_name, column_name):
+        return False
+
+    connection.exec_driver_sql(
+        f'ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}')
+    return True
+
+
+def create_index(connection, model, index_name):
+    """Create the index called `index_name` declared on `model`, unless it
+    already exists or is declared for another database dialect."""
+
+    index, = (i for i in model.__table__.indexes if i.name == index_name)
+    index.create(connection, checkfirst=True)
@@ -1,12 +1,23 @@
 """SQLAlchemy models for Warbler."""
 
+import importlib
+import sqlite3
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, Integer, PrimaryKeyConstraint, String
+from sqlalchemy import UniqueConstraint, and_, event, exists, literal
+from sqlalchemy import literal_column, or_, select, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.sql.functions import FunctionElement
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import hasher
+from pagination import decode_cursor, encode_cursor, USERS_PER_PAGE
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
@@ -17,6 +28,97 @@ DEFAULT_HEADER_IMAGE_URL = (
     "rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=for" +
     "mat&fit=crop&w=2070&q=80")
 
+# How many message ids we keep materialized in each user's home timeline
+TIMELINE_LENGTH = 800
+
+# Dialects whose INSERT supports ON CONFLICT DO NOTHING. Their modules
+# are imported when first used; the engine has loaded its own by then.
+UPSERT_DIALECTS = {'postgresql', 'sqlite'}
+
+
+# Shorter search terms only match the start of usernames: the trigram
+# index can't serve them, so a substring match would scan the table
+SUBSTRING_SEARCH_MIN = 3
+
+# Above every character, to bound a prefix range
+MAX_CHAR = '\U0010ffff'
+
+
+class username_key(FunctionElement):
+    """lower(username) in byte order, how user search sorts and pages.
+
+    On Postgres that means COLLATE "C", so ix_users_username_key serves
+    prefix ranges, the sort and the keyset alike; SQLite compares bytes
+    already.
+    """
+
+    type = String()
+    name = 'username_key'
+    inherit_cache = True
+
+
+@compiles(username_key)
+def compile_username_key(element, compiler, **kw):
+    return f"lower({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(username_key, 'postgresql')
+def compile_username_key_postgresql(element, compiler, **kw):
+    return f'lower({compiler.process(element.clauses, **kw)}) COLLATE "C"'
+
+
+def insert_ignoring_conflicts(model, rows, names=None):
+    """Return an INSERT into `model` that skips rows which would violate a
+    unique or primary key constraint.
+
+    `rows` is a dict of values for one row, or a SELECT of rows for the
+    columns `names`. Where the dialect supports it that's ON CONFLICT DO
+    NOTHING; elsewhere only rows no existing row conflicts with are
+    selected, which a concurrent insert can still race.
+    """
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in UPSERT_DIALECTS:
+        insert = importlib.import_module(f'sqlalchemy.dialects.{dialect}').insert
+
+        if isinstance(rows, dict):
+            statement = insert(model).values(rows)
+        else:
+            statement = insert(model).from_select(names, rows)
+
+        return statement.on_conflict_do_nothing()
+
+    table = model.__table__
+
+    if isinstance(rows, dict):
+        names = list(rows)
+        rows = select(*(
+            literal(value, table.c[name].type) for name, value in rows.items()
+        ))
+
+    candidates = rows.subquery()
+    values = dict(zip(names, candidates.c))
+
+    # Every unique key whose columns are all being inserted
+    keys = [
+        constraint.columns for constraint in table.constraints
+        if isinstance(constraint, (PrimaryKeyConstraint, UniqueConstraint))
+    ] + [index.columns for index in table.indexes if index.unique]
+
+    conflicts = [
+        and_(*(column == values[column.name] for column in key))
+        for key in keys
+        if key and all(column.name in values for column in key)
+    ]
+
+    new_rows = select(*candidates.c)
+
+    if conflicts:
+        new_rows = new_rows.where(~exists().where(or_(*conflicts)))
+
+    return db.insert(model).from_select(names, new_rows)
+
 
 class Follow(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -35,6 +137,72 @@ class Follow(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # The primary key leads with the followed user, so it only serves
+        # "who follows X"; this serves "whom does X follow"
+        db.Index(
+            'ix_follows_user_following_id',
+            'user_following_id',
+            'user_being_followed_id',
+        ),
+    )
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? A primary key lookup."""
+
+        return db.session.query(
+            select(cls)
+            .where(
+                (cls.user_following_id == follower_id) &
+                (cls.user_being_followed_id == followed_id)
+            )
+            .exists()
+        ).scalar()
+
+    @classmethod
+    def add(cls, follower_id, followed_ids):
+        """Make `follower_id` follow each of `followed_ids`, in one statement.
+
+        Ids that are already followed, don't exist, are deactivated or are
+        the follower's own are skipped. Returns the ids newly followed.
+        """
+
+        if not followed_ids:
+            return []
+
+        new_follows = (
+            select(User.id, literal(follower_id))
+            .where(User.id.in_(followed_ids) & (User.id != follower_id))
+            .where(User.deactivated_at.is_(None))
+        )
+
+        return db.session.scalars(
+            insert_ignoring_conflicts(
+                cls,
+                new_follows,
+                ['user_being_followed_id', 'user_following_id'],
+            )
+            .returning(cls.user_being_followed_id)
+        ).all()
+
+    @classmethod
+    def remove(cls, follower_id, followed_ids):
+        """Make `follower_id` stop following each of `followed_ids`, in one
+        statement. Returns the ids that were actually unfollowed."""
+
+        if not followed_ids:
+            return []
+
+        return db.session.scalars(
+            db.delete(cls)
+            .where(
+                (cls.user_following_id == follower_id) &
+                (cls.user_being_followed_id.in_(followed_ids))
+            )
+            .returning(cls.user_being_followed_id)
+        ).all()
+
 
 class User(db.Model):
     """User in the system."""
@@ -87,22 +255,101 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Bumped whenever the fields shown next to this user's messages change,
+    # so cached message fragments for them are no longer used
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Set when the user deletes their account. They can no longer log in
+    # or be found, and their rows are purged in the background (see
+    # purge.py); the user row itself goes last
+    deactivated_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    # DENORMALIZED COUNTERS
+    # Kept in step by the write paths; `flask repair-counters` recomputes them
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    __table_args__ = (
+        # Trigram index so substring searches on username don't scan the
+        # table; needs the pg_trgm extension (created below)
+        db.Index(
+            'ix_users_username_trgm',
+            'username',
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'},
+        ).ddl_if(dialect='postgresql'),
+        # Prefix searches, in the order and with the keyset they page by
+        db.Index('ix_users_username_key', username_key(username), 'id'),
+    )
+
+    # The (tier, id, username key) a search cursor holds; the free-text
+    # key goes last (see decode_cursor())
+    SEARCH_CURSOR_COLUMNS = (
+        literal_column('tier', Integer),
+        literal_column('id', Integer),
+        literal_column('username_key', String),
+    )
+
     #DB RELATIONSHIPS
+    # passive_deletes: deleting a row leaves its messages, follows and likes
+    # to the foreign keys' ON DELETE CASCADE instead of loading them all
 
-    messages = db.relationship('Message', backref="user")
+    messages = db.relationship(
+        'Message',
+        backref="user",
+        cascade="all, delete",
+        passive_deletes=True,
+    )
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follow.user_being_followed_id == id),
         secondaryjoin=(Follow.user_following_id == id),
-        backref="following",
+        backref=db.backref("following", passive_deletes=True),
+        passive_deletes=True,
     )
 
     liked_messages = db.relationship(
                             'Message',
                             secondary='likes',
-                            backref='users_liked'
+                            backref=db.backref(
+                                'users_liked', passive_deletes=True),
+                            passive_deletes=True,
     )
 
     def __repr__(self):
@@ -115,7 +362,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -137,30 +384,307 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        If the stored hash was made with an outdated work factor, it is
+        replaced (commit to save it).
         """
 
-        user = cls.query.filter_by(username=username).one_or_none()
+        user = cls.query.filter_by(
+            username=username, deactivated_at=None).one_or_none()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does `password` match this user's hash?
+
+        If the stored hash was made with an outdated work factor, it is
+        replaced (commit to save it).
+        """
+
+        if not hasher.check(self.password, password):
+            return False
+
+        if hasher.needs_rehash(self.password):
+            self.password = hasher.rehash(password)
+
+        return True
+
+    @classmethod
+    def search(cls, term, after=None, per_page=USERS_PER_PAGE):
+        """Return a page of active users whose username contains `term`,
+        ignoring case, and the cursor for the next page (None on the
+        last).
+
+        Usernames starting with `term` come first, in username order, from
+        a range of ix_users_username_key. Then, for terms of at least
+        SUBSTRING_SEARCH_MIN characters, those containing it elsewhere,
+        found through the trigram index and also in username order.
+        """
+
+        term = term.lower()
+        key = username_key(cls.username)
+
+        prefix = (key >= term) & (key < term + MAX_CHAR)
+        tiers = [prefix]
+
+        if len(term) >= SUBSTRING_SEARCH_MIN:
+            escaped = (term
+                       .replace('\\', '\\\\')
+                       .replace('%', '\\%')
+                       .replace('_', '\\_'))
+            tiers.append(
+                cls.username.ilike(f"%{escaped}%", escape='\\') & ~prefix)
+
+        first_tier, after_key = 0, None
+
+        if after:
+            first_tier, user_id, name = decode_cursor(
+                after, cls.SEARCH_CURSOR_COLUMNS)
+            after_key = (name, user_id)
+
+        rows = []
+
+        for tier in range(first_tier, len(tiers)):
+            query = (
+                db.session.query(cls, key.label('username_key'))
+                .filter(tiers[tier])
+                .filter(cls.deactivated_at.is_(None))
+            )
+
+            if tier == first_tier and after_key:
+                query = query.filter(tuple_(key, cls.id) > after_key)
+
+            found = (query
+                     .order_by(key, cls.id)
+                     .limit(per_page + 1 - len(rows))
+                     .all())
+            rows.extend((tier, row) for row in found)
+
+            if len(rows) > per_page:
+                rows = rows[:per_page]
+                tier, last = rows[-1]
+                next_cursor = encode_cursor(
+                    (tier, last.User.id, last.username_key))
+
+                return [row.User for _, row in rows], next_cursor
+
+        return [row.User for _, row in rows], None
+
+    def follow(self, other_user):
+        """Start following `other_user`; return False if we already did."""
+
+        return bool(self.follow_many([other_user.id]))
+
+    def unfollow(self, other_user):
+        """Stop following `other_user`; return False if we weren't."""
+
+        return bool(self.unfollow_many([other_user.id]))
+
+    def follow_many(self, user_ids):
+        """Follow every user in `user_ids` and backfill our home timeline.
+
+        Writes directly to the follows table without loading the
+        `following` collection, so any copy of it already loaded in this
+        session is stale until the next commit. Returns the ids that were
+        newly followed.
+        """
+
+        followed = Follow.add(self.id, user_ids)
+
+        if followed:
+            TimelineEntry.backfill(self.id, followed)
+            User.adjust_follow_counts(self.id, followed, 1)
+
+        return followed
+
+    def unfollow_many(self, user_ids):
+        """Stop following every user in `user_ids` and drop their warbles
+        from our home timeline. Returns the ids that were unfollowed."""
+
+        unfollowed = Follow.remove(self.id, user_ids)
+
+        if unfollowed:
+            TimelineEntry.remove_authors(self.id, unfollowed)
+            User.adjust_follow_counts(self.id, unfollowed, -1)
+
+        return unfollowed
+
+    @classmethod
+    def adjust_follow_counts(cls, follower_id, followed_ids, delta):
+        """Add `delta` to the follow counters of both sides of the follows
+        from `follower_id` to each of `followed_ids`."""
+
+        db.session.execute(
+            db.update(cls)
+            .where(cls.id == follower_id)
+            .values(
+                following_count=cls.following_count + delta * len(followed_ids)
+            )
+        )
+        db.session.execute(
+            db.update(cls)
+            .where(cls.id.in_(followed_ids))
+            .values(followers_count=cls.followers_count + delta)
+        )
+
+    @classmethod
+    def purge_batch(cls, user_id, batch_size):
+        """Delete up to `batch_size` rows that depend on a deactivated user.
+
+        Works through the user's messages, the likes they gave and their
+        follows in both directions, decrementing the counters other rows
+        hold because of them; the foreign key cascades take care of likes
+        and timeline entries for deleted messages. Once nothing else is
+        left it deletes the user row and returns False; until then it
+        returns True. Commit after each call.
+        """
+
+        message_ids = db.session.scalars(
+            select(Message.id)
+            .where(Message.user_id == user_id)
+            .limit(batch_size)
+        ).all()
+
+        if message_ids:
+            likers = (
+                select(Like.user_id, db.func.count().label('n'))
+                .where(Like.message_id.in_(message_ids))
+                .where(Like.user_id != user_id)
+                .group_by(Like.user_id)
+                .subquery()
+            )
+            db.session.execute(
+                db.update(cls)
+                .where(cls.id == likers.c.user_id)
+                .values(likes_count=cls.likes_count - likers.c.n)
+            )
+            db.session.execute(
+                db.delete(Message).where(Message.id.in_(message_ids)))
+            return True
+
+        liked_ids = db.session.scalars(
+            select(Like.message_id)
+            .where(Like.user_id == user_id)
+            .limit(batch_size)
+        ).all()
+
+        if liked_ids:
+            db.session.execute(
+                db.update(Message)
+                .where(Message.id.in_(liked_ids))
+                .values(likes_count=Message.likes_count - 1)
+            )
+            db.session.execute(
+                db.delete(Like).where(
+                    (Like.user_id == user_id) &
+                    (Like.message_id.in_(liked_ids))
+                )
+            )
+            return True
+
+        followed_ids = db.session.scalars(
+            select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == user_id)
+            .limit(batch_size)
+        ).all()
+
+        if followed_ids:
+            Follow.remove(user_id, followed_ids)
+            db.session.execute(
+                db.update(cls)
+                .where(cls.id.in_(followed_ids))
+                .values(followers_count=cls.followers_count - 1)
+            )
+            return True
+
+        follower_ids = db.session.scalars(
+            select(Follow.user_following_id)
+            .where(Follow.user_being_followed_id == user_id)
+            .limit(batch_size)
+        ).all()
+
+        if follower_ids:
+            db.session.execute(
+                db.delete(Follow).where(
+                    (Follow.user_being_followed_id == user_id) &
+                    (Follow.user_following_id.in_(follower_ids))
+                )
+            )
+            db.session.execute(
+                db.update(cls)
+                .where(cls.id.in_(follower_ids))
+                .values(following_count=cls.following_count - 1)
+            )
+            return True
+
+        db.session.execute(db.delete(cls).where(cls.id == user_id))
+        return False
+
+    @classmethod
+    def repair_counters(cls):
+        """Recompute every user and message counter from the source tables."""
+
+        def count(*criteria):
+            return (
+                select(db.func.count())
+                .where(*criteria)
+                .correlate(cls)
+                .scalar_subquery()
+            )
+
+        db.session.execute(
+            db.update(cls).values(
+                messages_count=count(Message.user_id == cls.id),
+                following_count=count(Follow.user_following_id == cls.id),
+                followers_count=count(
+                    Follow.user_being_followed_id == cls.id),
+                likes_count=count(Like.user_id == cls.id),
+            )
+        )
+        db.session.execute(
+            db.update(Message).values(
+                likes_count=(
+                    select(db.func.count())
+                    .where(Like.message_id == Message.id)
+                    .correlate(Message)
+                    .scalar_subquery()
+                )
+            )
+        )
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follow.exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follow.exists(self.id, other_user.id)
+
+    def following_ids(self, user_ids):
+        """Return the subset of `user_ids` this user follows, in one query."""
+
+        if not user_ids:
+            return set()
+
+        return set(db.session.scalars(
+            select(Follow.user_being_followed_id).where(
+                (Follow.user_following_id == self.id) &
+                (Follow.user_being_followed_id.in_(user_ids))
+            )
+        ))
+
+
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(
+        dialect='postgresql'),
+)
 
 
 class Message(db.Model):
@@ -190,6 +714,308 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    __table_args__ = (
+        # One user's messages, newest first: profile pages and backfilling
+        # a timeline when a follow starts
+        db.Index(
+            'ix_messages_user_timestamp',
+            'user_id',
+            timestamp.desc(),
+            id.desc(),
+        ),
+    )
+
+    @classmethod
+    def in_order(cls, message_ids):
+        """Return the messages with `message_ids`, with their authors, in
+        that order. Ids of messages that no longer exist are skipped."""
+
+        messages = {
+            message.id: message
+            for message in cls.query
+            .options(joinedload(cls.user))
+            .filter(cls.id.in_(message_ids))
+        }
+
+        return [messages[id] for id in message_ids if id in messages]
+
+
+# Full-text search on Postgres (see search.py): a tsvector of each
+# message's text that Postgres keeps up to date itself, and its index
+SEARCH_VECTOR_DDL = (
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', text)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_search_vector "
+    "ON messages USING gin (search_vector)",
+)
+
+for statement in SEARCH_VECTOR_DDL:
+    event.listen(
+        Message.__table__,
+        'after_create',
+        DDL(statement).execute_if(dialect='postgresql'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written when a message is created (fan-out-on-write to the
+    author and all of their followers) and when a follow starts; they are
+    removed by the message FK cascade or when a follow ends. Each
+    timeline is kept to roughly TIMELINE_LENGTH entries: fan-out only
+    adds, and a trim_followers job cuts back the timelines a post went
+    to (see trimming.py).
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_timestamp',
+            'user_id',
+            timestamp.desc(),
+            message_id.desc(),
+        ),
+    )
+
+    @classmethod
+    def fan_out(cls, connection, message):
+        """Insert `message` into its author's and followers' timelines."""
+
+        followers = select(
+            Follow.user_following_id,
+            literal(message.id),
+            literal(message.user_id),
+            literal(message.timestamp),
+        ).where(Follow.user_being_followed_id == message.user_id)
+
+        author = select(
+            literal(message.user_id),
+            literal(message.id),
+            literal(message.user_id),
+            literal(message.timestamp),
+        )
+
+        connection.execute(
+            db.insert(cls).from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                followers.union_all(author),
+            )
+        )
+
+    @classmethod
+    def backfill(cls, user_id, author_ids):
+        """Copy the recent messages of each of `author_ids` into `user_id`'s
+        timeline, then trim it back to TIMELINE_LENGTH."""
+
+        recent = (
+            select(
+                literal(user_id),
+                Message.id,
+                Message.user_id,
+                Message.timestamp,
+            )
+            .where(Message.user_id.in_(author_ids))
+            .order_by(Message.timestamp.desc())
+            .limit(TIMELINE_LENGTH)
+        )
+
+        db.session.execute(
+            db.insert(cls).from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                recent,
+            )
+        )
+        cls.trim(user_id)
+
+    @classmethod
+    def remove_authors(cls, user_id, author_ids):
+        """Remove every message by any of `author_ids` from `user_id`'s
+        timeline."""
+
+        db.session.execute(
+            db.delete(cls).where(
+                (cls.user_id == user_id) & (cls.author_id.in_(author_ids))
+            )
+        )
+
+    @classmethod
+    def trim(cls, user_id):
+        """Drop entries older than the newest TIMELINE_LENGTH."""
+
+        cutoff = (
+            select(cls.timestamp)
+            .where(cls.user_id == user_id)
+            .order_by(cls.timestamp.desc())
+            .offset(TIMELINE_LENGTH - 1)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+        db.session.execute(
+            db.delete(cls).where(
+                (cls.user_id == user_id) & (cls.timestamp < cutoff)
+            )
+        )
+
+    @classmethod
+    def trim_many(cls, user_ids=None):
+        """Trim each of `user_ids`' timelines (every timeline if None)
+        back to TIMELINE_LENGTH entries, in one statement."""
+
+        ranked = select(
+            cls.user_id,
+            cls.message_id,
+            db.func.row_number().over(
+                partition_by=cls.user_id,
+                order_by=(cls.timestamp.desc(), cls.message_id.desc()),
+            ).label('position'),
+        )
+
+        if user_ids is not None:
+            ranked = ranked.where(cls.user_id.in_(user_ids))
+
+        ranked = ranked.subquery()
+
+        stale = (
+            select(ranked.c.user_id, ranked.c.message_id)
+            .where(ranked.c.position > TIMELINE_LENGTH)
+        )
+
+        db.session.execute(
+            db.delete(cls).where(
+                db.tuple_(cls.user_id, cls.message_id).in_(stale)
+            )
+        )
+
+    @classmethod
+    def trim_all(cls):
+        """Trim every user's timeline back to TIMELINE_LENGTH entries.
+
+        Reads the whole table; for repairs by hand (trim-timelines).
+        """
+
+        cls.trim_many()
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuild every timeline from the messages and follows tables.
+
+        Used after bulk loads, which bypass the ORM fan-out. Only each
+        user's newest TIMELINE_LENGTH entries are written.
+        """
+
+        db.session.execute(db.delete(cls))
+
+        followers = (
+            select(
+                Follow.user_following_id.label('user_id'),
+                Message.id.label('message_id'),
+                Message.user_id.label('author_id'),
+                Message.timestamp.label('timestamp'),
+            )
+            .join(Follow, Follow.user_being_followed_id == Message.user_id)
+        )
+
+        authors = select(
+            Message.user_id,
+            Message.id,
+            Message.user_id,
+            Message.timestamp,
+        )
+
+        entries = followers.union_all(authors).subquery()
+
+        ranked = select(
+            entries,
+            db.func.row_number().over(
+                partition_by=entries.c.user_id,
+                order_by=(
+                    entries.c.timestamp.desc(), entries.c.message_id.desc()),
+            ).label('position'),
+        ).subquery()
+
+        db.session.execute(
+            db.insert(cls).from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                select(
+                    ranked.c.user_id,
+                    ranked.c.message_id,
+                    ranked.c.author_id,
+                    ranked.c.timestamp,
+                ).where(ranked.c.position <= TIMELINE_LENGTH),
+            )
+        )
+
+
+@event.listens_for(Message, 'after_insert')
+def fan_out_message(mapper, connection, message):
+    """Keep home timelines and the author's count up to date as messages
+    are created."""
+
+    TimelineEntry.fan_out(connection, message)
+    connection.execute(
+        db.update(User)
+        .where(User.id == message.user_id)
+        .values(messages_count=User.messages_count + 1)
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def release_message_counters(session, flush_context, instances):
+    """Update counters for messages about to be deleted.
+
+    This runs before the flush (rather than as a mapper before_delete hook)
+    because the flush removes a message's likes before the message itself.
+    """
+
+    deleted = [obj for obj in session.deleted if isinstance(obj, Message)]
+
+    for message in deleted:
+        connection = session.connection()
+        connection.execute(
+            db.update(User)
+            .where(User.id == message.user_id)
+            .values(messages_count=User.messages_count - 1)
+        )
+        connection.execute(
+            db.update(User)
+            .where(User.id.in_(
+                select(Like.user_id).where(Like.message_id == message.id)))
+            .values(likes_count=User.likes_count - 1)
+        )
+
+
 class Like(db.Model):
     """Tracks a user's like on a warble"""
 
@@ -207,13 +1033,169 @@ class Like(db.Model):
         primary_key=True
     )
 
+    __table_args__ = (
+        # The primary key leads with user_id; this serves finding a
+        # message's likes, e.g. when it is deleted
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def liked_ids(cls, user_id, message_ids):
+        """Return the set of `message_ids` that `user_id` has liked."""
+
+        if not message_ids:
+            return set()
+
+        return set(db.session.scalars(
+            select(cls.message_id).where(
+                (cls.user_id == user_id) & (cls.message_id.in_(message_ids))
+            )
+        ))
+
+
+@event.listens_for(Like, 'after_insert')
+def count_like(mapper, connection, like):
+    """Count a new like on both the user and the message."""
+
+    adjust_like_counts(connection, like, 1)
+
+
+@event.listens_for(Like, 'after_delete')
+def uncount_like(mapper, connection, like):
+    """Stop counting a removed like on both the user and the message."""
+
+    adjust_like_counts(connection, like, -1)
+
+
+def adjust_like_counts(connection, like, delta):
+    """Add `delta` to the like counters touched by `like`."""
+
+    connection.execute(
+        db.update(User)
+        .where(User.id == like.user_id)
+        .values(likes_count=User.likes_count + delta)
+    )
+    connection.execute(
+        db.update(Message)
+        .where(Message.id == like.message_id)
+        .values(likes_count=Message.likes_count + delta)
+    )
+
+
+class Job(db.Model):
+    """A unit of background work, run by a worker from jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # Name of the function registered with @jobs.task
+    task = db.Column(
+        db.String(100),
+        nullable=False,
+    )
+
+    # Keyword arguments for the task
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # Enqueueing a job whose key is already taken does nothing
+    idempotency_key = db.Column(
+        db.String(200),
+        nullable=True,
+        unique=True,
+    )
+
+    status = db.Column(
+        db.String(10),
+        nullable=False,
+        default=QUEUED,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    # Not run before this time; pushed back after each failed attempt
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # While running, a worker owns the job until this time; after it the
+    # job is assumed lost (e.g. the worker died) and is run again
+    locked_until = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    last_error = db.Column(
+        db.Text,
+        nullable=True,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    __table_args__ = (
+        # Finding the next job to run
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.task} {self.status}>"
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Turn on foreign keys for each new SQLite connection.
+
+    SQLite ignores them otherwise, so none of the ON DELETE CASCADE rules
+    (timeline entries, passive_deletes relationships) would fire.
+    """
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. No app context is pushed;
+    code using the database outside a request needs one of its own:
+
+        with app.app_context():
+            ...
     """
 
-    app.app_context().push()
-    db.app = app
     db.init_app(app)
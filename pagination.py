@@ -0,0 +1,89 @@
+"""Keyset (cursor) pagination for Warbler list pages.
+
+A page is requested with `?before=<cursor>`, where the cursor holds the
+sort key of the last item on the previous page (e.g. `<timestamp>,<id>`).
+Every page is then a single range query of a fixed size, so deep pages
+cost the same as the first one.
+"""
+
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import tuple_
+
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 48
+
+CURSOR_SEPARATOR = ","
+
+
+def encode_cursor(values):
+    """Turn a tuple of sort-key values into a cursor string."""
+
+    return CURSOR_SEPARATOR.join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values
+    )
+
+
+def decode_cursor(cursor, columns):
+    """Parse `cursor` into values matching the types of `columns`.
+
+    Responds with a 400 if the cursor is malformed.
+    """
+
+    # The last value may be free text (e.g. a username), so leave it whole
+    parts = cursor.split(CURSOR_SEPARATOR, len(columns) - 1)
+
+    if len(parts) != len(columns):
+        abort(400)
+
+    try:
+        return tuple(
+            datetime.fromisoformat(part)
+            if column.type.python_type is datetime
+            else column.type.python_type(part)
+            for part, column in zip(parts, columns)
+        )
+    except ValueError:
+        abort(400)
+
+
+def paginate(
+        query,
+        columns,
+        key,
+        before=None,
+        per_page=MESSAGES_PER_PAGE,
+        descending=True,
+):
+    """Return one page of `query` ordered by `columns`.
+
+    - columns: the sort key, e.g. (Message.timestamp, Message.id)
+    - key: function returning the sort-key values for a result item
+    - before: the cursor from the previous page, if any
+    - descending: newest/largest first (the default) or ascending
+
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+
+    if before:
+        cursor = decode_cursor(before, columns)
+        query = query.filter(
+            tuple_(*columns) < cursor
+            if descending
+            else tuple_(*columns) > cursor
+        )
+
+    items = (query
+             .order_by(*(
+                 column.desc() if descending else column.asc()
+                 for column in columns))
+             .limit(per_page + 1)
+             .all())
+
+    if len(items) > per_page:
+        items = items[:per_page]
+        return items, encode_cursor(key(items[-1]))
+
+    return items, None
@@ -0,0 +1,72 @@
+"""Removing deleted accounts without blocking a request.
+
+delete_user() only deactivates an account, which is one small UPDATE,
+and enqueues a purge_user job in the same transaction. The account's
+messages, likes and follows are then deleted by a job worker in batches
+of PURGE_BATCH_SIZE rows, each in its own short transaction, so even a
+very prolific account never holds locks or worker memory for long.
+
+A purge interrupted by a restart is retried by the job queue; any left
+over can be finished by hand with
+
+    flask purge-deactivated
+"""
+
+from sqlalchemy import select, update
+
+import jobs
+from models import db, User
+
+PURGE_BATCH_SIZE = 1000
+
+# Seconds a worker may spend purging one user before the job is retried
+PURGE_TIMEOUT = 3600
+
+
+@jobs.task('purge_user', timeout=PURGE_TIMEOUT)
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE):
+    """Delete a deactivated user and everything that depends on them.
+
+    Does nothing if the user doesn't exist or hasn't been deactivated.
+    """
+
+    deactivated_at = db.session.scalar(
+        select(User.deactivated_at).where(User.id == user_id))
+
+    if deactivated_at is None:
+        return
+
+    # Every worker's cached fragments of their messages go stale
+    # (see fragments.py)
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(profile_version=User.profile_version + 1))
+    db.session.commit()
+
+    while User.purge_batch(user_id, batch_size):
+        db.session.commit()
+
+    db.session.commit()
+
+
+def purge_deactivated(batch_size=PURGE_BATCH_SIZE):
+    """Finish purging every deactivated user; return how many there were."""
+
+    user_ids = db.session.scalars(
+        select(User.id).where(User.deactivated_at.is_not(None))).all()
+
+    for user_id in user_ids:
+        purge_user(user_id, batch_size)
+
+    return len(user_ids)
+
+
+def enqueue_purge(user_id):
+    """Queue purging `user_id`, once, with the caller's transaction."""
+
+    return jobs.enqueue(
+        'purge_user',
+        {'user_id': user_id},
+        idempotency_key=f'purge-user-{user_id}',
+    )
@@ -0,0 +1,144 @@
+"""Check that the hot queries are served by the indexes meant for them.
+
+Each query in HOT_QUERIES is run through EXPLAIN and the plan searched for
+its index. On Postgres sequential scans are disabled for the check, so a
+small or empty table still shows whether the index *can* serve the query
+rather than what the planner happens to prefer at that size.
+
+    flask check-query-plans
+"""
+
+import json
+import re
+
+from sqlalchemy import func, select
+
+from models import db, Follow, Like, Message, TimelineEntry, User
+from models import MAX_CHAR, username_key
+from pagination import MESSAGES_PER_PAGE, USERS_PER_PAGE
+import search
+import timelines
+
+SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+# name: (index that should serve it, dialects it applies to, statement)
+HOT_QUERIES = {
+    'home timeline': (
+        'ix_timeline_entries_user_timestamp',
+        None,
+        select(TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == 1)
+        .order_by(
+            TimelineEntry.timestamp.desc(), TimelineEntry.message_id.desc())
+        .limit(MESSAGES_PER_PAGE + 1),
+    ),
+    'profile messages': (
+        'ix_messages_user_timestamp',
+        None,
+        select(Message.id)
+        .where(Message.user_id == 1)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(MESSAGES_PER_PAGE + 1),
+    ),
+    'timeline authors': (
+        'ix_messages_user_timestamp',
+        ('postgresql',),
+        timelines.newest_messages_lateral([1, 2], MESSAGES_PER_PAGE + 1),
+    ),
+    'following list': (
+        'ix_follows_user_following_id',
+        None,
+        select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == 1),
+    ),
+    'message likes': (
+        'ix_likes_message_id',
+        None,
+        select(Like.user_id).where(Like.message_id == 1),
+    ),
+    'username search': (
+        'ix_users_username_trgm',
+        ('postgresql',),
+        select(User.id).where(User.username.ilike('%abc%')),
+    ),
+    'username prefix search': (
+        'ix_users_username_key',
+        None,
+        select(User.id)
+        .where(username_key(User.username) >= 'ab')
+        .where(username_key(User.username) < 'ab' + MAX_CHAR)
+        .order_by(username_key(User.username), User.id)
+        .limit(USERS_PER_PAGE + 1),
+    ),
+    'message search': (
+        'ix_messages_search_vector',
+        ('postgresql',),
+        select(Message.id).where(search.search_vector.op('@@')(
+            func.websearch_to_tsquery(search.SEARCH_CONFIG, 'abc'))),
+    ),
+}
+
+
+def indexes_used(connection, statement):
+    """Return the names of the indexes in `statement`'s query plan."""
+
+    compiled = statement.compile(
+        connection, compile_kwargs={'render_postcompile': True})
+
+    if compiled.positiontup is not None:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return set(_plan_indexes(plan[0]['Plan']))
+
+    rows = connection.exec_driver_sql(
+        f'EXPLAIN QUERY PLAN {compiled}', params).all()
+    return {
+        name for row in rows for name in SQLITE_INDEX.findall(row[-1])
+    }
+
+
+def _plan_indexes(node):
+    """Yield the index names in a Postgres JSON plan node and below it."""
+
+    if 'Index Name' in node:
+        yield node['Index Name']
+
+    for child in node.get('Plans', []):
+        yield from _plan_indexes(child)
+
+
+def check():
+    """EXPLAIN every hot query that applies to this database.
+
+    Returns a list of (name, expected index, indexes used) for the queries
+    whose plan doesn't use the expected index; empty if all is well.
+    """
+
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    failures = []
+
+    if dialect == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+
+    try:
+        for name, (index, dialects, statement) in HOT_QUERIES.items():
+            if dialects and dialect not in dialects:
+                continue
+
+            used = indexes_used(connection, statement)
+
+            if index not in used:
+                failures.append((name, index, used))
+
+    finally:
+        db.session.rollback()
+
+    return failures
@@ -0,0 +1,81 @@
+"""Optional read replica routing with read-your-writes stickiness.
+
+With DATABASE_REPLICA_URL set, the engine for it is registered as the
+"replica" bind, and reads made while handling GET (and HEAD/OPTIONS)
+requests go there. Everything else uses the primary:
+
+- requests with other methods, and any code outside a request
+- flushes and INSERT/UPDATE/DELETE statements
+- requests from a user who wrote something in the last
+  REPLICA_PIN_SECONDS (default 5), so they see their own post, like or
+  follow even if the replica lags behind. The pin is kept in the
+  session cookie, so it works across workers.
+
+To try it locally, point DATABASE_REPLICA_URL at a second database (for
+Postgres, a streaming replica or just a copy) and watch X-DB-Queries on a
+page while posting from another tab.
+"""
+
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = "replica"
+PIN_KEY = "primary_until"
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RoutingSession(Session):
+    """A session that sends a request's reads to the replica when it's
+    safe to, and remembers when a request wrote to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or getattr(clause, "is_dml", False):
+                g.wrote_to_primary = True
+
+            elif self._reads_from_replica():
+                return self._db.engines[REPLICA_BIND]
+
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self):
+        return (
+            REPLICA_BIND in self._db.engines and
+            request.method in READ_METHODS and
+            not g.get("wrote_to_primary") and
+            not pinned_to_primary()
+        )
+
+
+def pinned_to_primary():
+    """Did the current user write something in the last few seconds?"""
+
+    return has_request_context() and session.get(PIN_KEY, 0) >= time.time()
+
+
+def replica_bind(url, engine_options):
+    """Return the SQLALCHEMY_BINDS entry for a replica at `url`."""
+
+    return {REPLICA_BIND: dict(engine_options, url=url)}
+
+
+def init_app(app):
+    """Pin users to the primary for a while after they write."""
+
+    app.config.setdefault("REPLICA_PIN_SECONDS", 5)
+
+    # g outlives a request when an app context was pushed beforehand (as
+    # tests and scripts do), so each request starts unflagged
+    @app.before_request
+    def reset_wrote_to_primary():
+        g.pop("wrote_to_primary", None)
+
+    @app.after_request
+    def pin_writers_to_primary(response):
+        if g.get("wrote_to_primary"):
+            session[PIN_KEY] = time.time() + app.config["REPLICA_PIN_SECONDS"]
+
+        return response
@@ -0,0 +1,267 @@
+"""Full-text search over messages, best matches first.
+
+Two backends, chosen by SEARCH_BACKEND ("postgres" on Postgres and
+"memory" elsewhere by default):
+
+- postgres: messages.search_vector, a tsvector of the text that Postgres
+  generates on every insert and update, with a GIN index
+  (ix_messages_search_vector; see migration 0009). Terms use web search
+  syntax ("quoted phrases", -excluded words, or) and English stemming;
+  matches are ranked with ts_rank_cd.
+- memory: an inverted index from word to message ids kept in this
+  process, for SQLite, tests and development. It is built from the
+  messages table on first use and updated when this process commits new
+  or deleted messages; other processes' changes show up after a restart.
+  Bulk deletes (purging an account) leave ids behind, which are dropped
+  when the page's messages are loaded.
+  Every term must match; matches are ranked by tf-idf.
+
+Either way only the newest SEARCH_CANDIDATES matches are ranked, so a
+common word doesn't mean scoring and sorting millions of rows per page:
+Postgres can find them walking the primary key backwards, checking each
+row against the query, or, for rare terms, through the GIN index. Pages
+of the ranked candidates are found with a (rank, id) keyset cursor, like
+the other list pages (see pagination.py). Paging deep into a broad term
+while new matches are posted can skip a few older ones, which have
+dropped out of the candidates.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy import Float, cast, event, func, literal_column, select
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Message
+from pagination import decode_cursor, encode_cursor, paginate
+from pagination import MESSAGES_PER_PAGE
+
+SEARCH_CONFIG = 'english'
+
+# How many of the newest matches are ranked
+SEARCH_CANDIDATES = 1000
+
+WORD = re.compile(r'\w+')
+
+# Not mapped on Message, since it only exists on Postgres
+search_vector = literal_column('messages.search_vector')
+
+# The (rank, id) values a cursor holds, for decode_cursor()
+CURSOR_COLUMNS = (literal_column('rank', Float), Message.id)
+
+
+def search_messages(terms, before=None, per_page=MESSAGES_PER_PAGE):
+    """Find messages matching `terms`, best first.
+
+    Returns (message ids, next_cursor); next_cursor is None on the last
+    page.
+    """
+
+    backend = current_app.config.get('SEARCH_BACKEND') or (
+        'postgres' if db.engine.dialect.name == 'postgresql' else 'memory')
+
+    if backend == 'postgres':
+        return postgres_search(terms, before, per_page)
+
+    return message_index.search(terms, before, per_page)
+
+
+def postgres_search(terms, before=None, per_page=MESSAGES_PER_PAGE):
+    """Search with the messages.search_vector GIN index."""
+
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+
+    candidates = (
+        select(Message.id, search_vector.label('search_vector'))
+        .where(search_vector.op('@@')(query))
+        .order_by(Message.id.desc())
+        .limit(SEARCH_CANDIDATES)
+        .subquery()
+    )
+
+    # Compared as double precision, so a cursor's rank round-trips exactly
+    rank = cast(
+        func.ts_rank_cd(candidates.c.search_vector, query), Float,
+    ).label('rank')
+
+    rows, next_cursor = paginate(
+        db.session.query(candidates.c.id, rank),
+        (rank, candidates.c.id),
+        key=lambda row: (row.rank, row.id),
+        before=before,
+        per_page=per_page,
+    )
+
+    return [row.id for row in rows], next_cursor
+
+
+def words(text):
+    """The lowercase words in `text`."""
+
+    return WORD.findall(text.lower())
+
+
+class InvertedIndex:
+    """Message ids by the words in their text, kept in memory.
+
+    Built from the database the first time it's searched; until then,
+    add() and remove() do nothing.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._loaded = False
+        # word: {message id: times the word appears in it}
+        self._postings = defaultdict(dict)
+        # message id: its words, to find its postings when it's removed
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def clear(self):
+        """Forget everything; the next search rebuilds the index."""
+
+        with self._lock:
+            self._loaded = False
+            self._postings.clear()
+            self._documents.clear()
+
+    def load(self):
+        """Index every message in the database, if not done yet."""
+
+        with self._lock:
+            if self._loaded:
+                return
+
+            rows = db.session.execute(
+                select(Message.id, Message.text)
+                .execution_options(yield_per=10_000))
+
+            for message_id, text in rows:
+                self._add(message_id, text)
+
+            self._loaded = True
+
+    def add(self, message_id, text):
+        """Index a new message."""
+
+        with self._lock:
+            if self._loaded:
+                self._add(message_id, text)
+
+    def remove(self, message_id):
+        """Stop finding a deleted message."""
+
+        with self._lock:
+            for word in self._documents.pop(message_id, ()):
+                postings = self._postings[word]
+                postings.pop(message_id, None)
+
+                if not postings:
+                    del self._postings[word]
+
+    def _add(self, message_id, text):
+        counts = Counter(words(text))
+        self._documents[message_id] = tuple(counts)
+
+        for word, count in counts.items():
+            self._postings[word][message_id] = count
+
+    def search(self, terms, before=None, per_page=MESSAGES_PER_PAGE):
+        """Find messages containing every word of `terms`, best first.
+
+        Returns (message ids, next_cursor) like postgres_search().
+        """
+
+        self.load()
+
+        cursor = None
+        if before:
+            cursor = decode_cursor(before, CURSOR_COLUMNS)
+
+        with self._lock:
+            scored = self._score(set(words(terms)))
+
+        if cursor:
+            scored = [key for key in scored if key < cursor]
+
+        page = scored[:per_page + 1]
+        next_cursor = None
+
+        if len(page) > per_page:
+            page = page[:per_page]
+            next_cursor = encode_cursor(page[-1])
+
+        return [message_id for _, message_id in page], next_cursor
+
+    def _score(self, query_words):
+        """Return (score, id) for each message containing all of
+        `query_words`, highest first. Call with the lock held."""
+
+        postings = [self._postings.get(word, {}) for word in query_words]
+
+        if not postings or not all(postings):
+            return []
+
+        postings.sort(key=len)
+        matches = heapq.nlargest(
+            SEARCH_CANDIDATES,
+            set(postings[0]).intersection(*postings[1:]),
+        )
+        total = len(self._documents)
+
+        scores = {
+            message_id: sum(
+                counts[message_id] * math.log(1 + total / len(counts))
+                for counts in postings
+            )
+            for message_id in matches
+        }
+
+        return sorted(
+            ((score, message_id) for message_id, score in scores.items()),
+            reverse=True,
+        )
+
+
+message_index = InvertedIndex()
+
+
+##############################################################################
+# Keeping the in-memory index up to date
+#
+# Messages added or deleted in a flush are noted on the session and only
+# applied to the index once the transaction commits.
+
+
+@event.listens_for(Message, 'after_insert')
+def note_indexed_message(mapper, connection, message):
+    changes = object_session(message).info.setdefault(
+        'search_changes', [])
+    changes.append((message.id, message.text))
+
+
+@event.listens_for(Message, 'after_delete')
+def note_unindexed_message(mapper, connection, message):
+    changes = object_session(message).info.setdefault(
+        'search_changes', [])
+    changes.append((message.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_search_changes(session):
+    for message_id, text in session.info.pop('search_changes', ()):
+        if text is None:
+            message_index.remove(message_id)
+        else:
+            message_index.add(message_id, text)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_search_changes(session, previous_transaction):
+    session.info.pop('search_changes', None)
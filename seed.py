@@ -1,19 +1,13 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follow
+from app import create_app
+from loader import load_dataset
+from models import db
+import migrations
 
-db.drop_all()
-db.create_all()
+with create_app().app_context():
+    db.drop_all()
+    db.create_all()
+    migrations.upgrade()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follow, DictReader(follows))
-
-db.session.commit()
+    load_dataset('generator')
@@ -0,0 +1,89 @@
+"use strict";
+
+// Like and follow buttons without a page reload.
+//
+// The like and follow forms still work on their own; when this script is
+// loaded it sends them to the JSON API instead and updates the button in
+// place. Anything unexpected falls back to submitting the form normally.
+
+const CSRF_TOKEN = document.querySelector('meta[name="csrf-token"]')?.content;
+
+const LIKE_ACTION = /^\/messages\/(\d+)\/(like|unlike)$/;
+const FOLLOW_ACTION = /^\/users\/(follow|stop-following)\/(\d+)$/;
+
+
+/** POST to a JSON API path; resolve to the parsed body. */
+async function postApi(path) {
+  const resp = await fetch(`/api${path}`, {
+    method: "POST",
+    headers: { "X-CSRFToken": CSRF_TOKEN, "Accept": "application/json" },
+    credentials: "same-origin",
+  });
+
+  if (!resp.ok) throw new Error(`${path}: ${resp.status}`);
+  return resp.json();
+}
+
+
+/** Show a like button as liked or not, pointing at the opposite action. */
+function showLike(button, messageId, liked) {
+  button.setAttribute(
+    "formaction", `/messages/${messageId}/${liked ? "unlike" : "like"}`);
+  button.id = liked ? "unlike-btn" : "like-btn";
+  button.querySelector("i").className = liked ? "bi bi-star-fill" : "bi bi-star";
+}
+
+
+/** Show a follow form's button as following or not. */
+function showFollow(form, userId, following) {
+  const button = form.querySelector("button");
+
+  form.setAttribute(
+    "action", `/users/${following ? "stop-following" : "follow"}/${userId}`);
+  button.textContent = following ? "Unfollow" : "Follow";
+  button.classList.toggle("btn-primary", following);
+  button.classList.toggle("btn-outline-primary", !following);
+}
+
+
+/** Send a like or follow form to the API; on failure submit it normally. */
+async function submitToApi(evt, form, button, action) {
+  evt.preventDefault();
+  button.disabled = true;
+
+  try {
+    const like = action.match(LIKE_ACTION);
+
+    if (like) {
+      const data = await postApi(`/messages/${like[1]}/${like[2]}`);
+      showLike(button, like[1], data.liked);
+    } else {
+      const [, follow, userId] = action.match(FOLLOW_ACTION);
+      const data = await postApi(`/users/${userId}/${follow}`);
+      showFollow(form, userId, data.following);
+    }
+  } catch (err) {
+    // form.submit() skips this handler and the button's formaction
+    form.setAttribute("action", action);
+    form.submit();
+  } finally {
+    button.disabled = false;
+  }
+}
+
+
+document.addEventListener("submit", function (evt) {
+  if (!CSRF_TOKEN) return;
+
+  const form = evt.target;
+  const button = evt.submitter || form.querySelector("button");
+  const action = new URL(
+    button?.getAttribute("formaction") || form.getAttribute("action") || "",
+    window.location.href,
+  ).pathname;
+
+  if ((form.classList.contains("like-star") && LIKE_ACTION.test(action)) ||
+      FOLLOW_ACTION.test(action)) {
+    submitToApi(evt, form, button, action);
+  }
+});
@@ -0,0 +1,76 @@
+"""App factory and configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import has_app_context
+
+from app import create_app, warm_up
+import config
+
+
+class ConfigTestCase(TestCase):
+    ENVIRON = {
+        "SECRET_KEY": "secret",
+        "DATABASE_URL": "postgresql:///warbler",
+    }
+
+    def test_config_name(self):
+        self.assertEqual(config.config_name({}), "production")
+        self.assertEqual(
+            config.config_name({"FLASK_DEBUG": "1"}), "development")
+        self.assertEqual(
+            config.config_name({"WARBLER_ENV": "testing", "FLASK_DEBUG": "1"}),
+            "testing")
+
+    def test_read_from_environ(self):
+        settings = config.ProductionConfig(
+            dict(self.ENVIRON, WEB_THREADS="3", STATS_ENABLED="true"))
+
+        self.assertEqual(settings.SQLALCHEMY_DATABASE_URI,
+                         "postgresql:///warbler")
+        self.assertEqual(settings.SQLALCHEMY_ENGINE_OPTIONS["pool_size"], 3)
+        self.assertTrue(settings.STATS_ENABLED)
+        self.assertFalse(settings.DEBUG_TB_ENABLED)
+
+    def test_testing_defaults(self):
+        settings = config.TestingConfig({})
+
+        self.assertEqual(settings.SQLALCHEMY_DATABASE_URI,
+                         "postgresql:///warbler_test")
+        self.assertFalse(settings.WTF_CSRF_ENABLED)
+        self.assertEqual(settings.BCRYPT_LOG_ROUNDS, 4)
+
+    def test_production_requires_secret_key(self):
+        with self.assertRaises(KeyError):
+            config.ProductionConfig({"DATABASE_URL": "postgresql:///warbler"})
+
+
+class AppFactoryTestCase(TestCase):
+    def test_no_app_context_pushed(self):
+        create_app("testing")
+
+        self.assertFalse(has_app_context())
+
+    def test_debug_toolbar_only_in_development(self):
+        testing = create_app("testing")
+        self.assertNotIn("debugtoolbar", testing.blueprints)
+
+        with patch.dict(os.environ, ConfigTestCase.ENVIRON):
+            development = create_app("development")
+
+        self.assertIn("debugtoolbar", development.blueprints)
+
+    def test_warm_up_compiles_templates(self):
+        app = create_app("testing")
+        self.assertEqual(len(app.jinja_env.cache), 0)
+
+        warm_up(app)
+
+        self.assertIn("base.html", {name for _, name in app.jinja_env.cache})
@@ -0,0 +1,213 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Job
+
+from app import create_app
+import jobs
+import trimming
+
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
+
+app = create_app('testing')
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+calls = []
+
+
+@jobs.task('test_record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('test_fail')
+def fail():
+    calls.append('fail')
+    raise ValueError("boom")
+
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_enqueue_and_run(self):
+        job_id = jobs.enqueue('test_record', {'value': 1})
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(calls, [1])
+
+        job = db.session.get(Job, job_id)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_uncommitted_job_not_run(self):
+        jobs.enqueue('test_record', {'value': 1})
+        db.session.rollback()
+
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(calls, [])
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue('no_such_task')
+
+    def test_idempotency_key(self):
+        first = jobs.enqueue('test_record', {'value': 1}, idempotency_key='k')
+        second = jobs.enqueue('test_record', {'value': 2}, idempotency_key='k')
+        db.session.commit()
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+
+        jobs.run_pending()
+
+        # Still taken once the job is done
+        self.assertIsNone(
+            jobs.enqueue('test_record', {'value': 3}, idempotency_key='k'))
+        self.assertEqual(calls, [1])
+
+    def test_idempotency_key_without_upsert(self):
+        with patch('models.UPSERT_DIALECTS', set()):
+            first = jobs.enqueue('test_record', {'value': 1}, idempotency_key='k')
+            second = jobs.enqueue('test_record', {'value': 2}, idempotency_key='k')
+            unkeyed = [jobs.enqueue('test_record', {'value': 3}) for _ in '12']
+        db.session.commit()
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertNotIn(None, unkeyed)
+        self.assertEqual(Job.query.count(), 3)
+        self.assertEqual(db.session.get(Job, first).payload, {'value': 1})
+
+    def test_future_job_waits(self):
+        jobs.enqueue('test_record', {'value': 1},
+                     run_at=datetime.utcnow() + timedelta(minutes=5))
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_retry_then_fail(self):
+        job_id = jobs.enqueue('test_fail', max_attempts=2)
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        job = db.session.get(Job, job_id)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+
+        # Due again after the backoff
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(calls, ['fail', 'fail'])
+
+        job = db.session.get(Job, job_id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_visibility_timeout(self):
+        job_id = jobs.enqueue('test_record', {'value': 1})
+        db.session.commit()
+
+        # A worker claims the job, then dies without running it
+        self.assertIsNotNone(jobs.claim())
+        self.assertIsNone(jobs.claim())
+
+        later = datetime.utcnow() + timedelta(seconds=jobs.DEFAULT_TIMEOUT + 1)
+        job = jobs.claim(now=later)
+
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.attempts, 2)
+
+        self.assertTrue(jobs.run(job))
+        self.assertEqual(calls, [1])
+
+    def test_stale_worker_result_ignored(self):
+        job_id = jobs.enqueue('test_fail')
+        db.session.commit()
+
+        # The first worker's claim times out and a second takes the job
+        jobs.claim()
+        later = datetime.utcnow() + timedelta(seconds=jobs.DEFAULT_TIMEOUT + 1)
+        jobs.run(jobs.claim(now=later))
+
+        # The first worker finally finishes, too late to record it
+        stale = Job(id=job_id, task='test_record', payload={'value': 1},
+                    attempts=1, max_attempts=jobs.DEFAULT_MAX_ATTEMPTS)
+        self.assertTrue(jobs.run(stale))
+
+        job = db.session.get(Job, job_id)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_delete_finished(self):
+        jobs.enqueue('test_record', {'value': 1})
+        db.session.commit()
+        jobs.run_pending()
+
+        self.assertEqual(jobs.delete_finished(datetime.utcnow()), 1)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_trim_enqueued_once_per_interval(self):
+        interval = trimming.TRIM_INTERVAL
+        start = 1_700_000_000 // interval * interval
+
+        first = trimming.enqueue_trim(1, now=start)
+        self.assertIsNone(trimming.enqueue_trim(1, now=start + 60))
+        trimming.enqueue_trim(2, now=start + 60)
+        trimming.enqueue_trim(1, now=start + interval)
+        db.session.commit()
+
+        self.assertEqual(
+            Job.query.filter_by(task='trim_followers').count(), 3)
+
+        # Due at the end of its interval
+        due = datetime.utcfromtimestamp(start + interval)
+        self.assertEqual(db.session.get(Job, first).run_at, due)
+
+    def test_worker_threads(self):
+        for value in range(5):
+            jobs.enqueue('test_record', {'value': value})
+        db.session.commit()
+
+        worker = jobs.Worker(app, threads=2, poll_interval=0.01)
+        worker.start()
+
+        deadline = datetime.utcnow() + timedelta(seconds=10)
+        while len(calls) < 5 and datetime.utcnow() < deadline:
+            worker._stopping.wait(0.01)
+
+        worker.stop()
+        worker.join()
+
+        self.assertEqual(sorted(calls), [0, 1, 2, 3, 4])
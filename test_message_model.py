@@ -5,29 +5,25 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from unittest import TestCase
 
-from models import db, User, Message, Like, DEFAULT_IMAGE_URL
+from models import db, User, Message, Like, TimelineEntry, DEFAULT_IMAGE_URL
 from sqlalchemy.exc import IntegrityError, DataError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
 
-# Now we can import app
-
-from app import app
+app = create_app('testing')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-db.drop_all()
-db.create_all()
+with app.app_context():
+    db.drop_all()
+    db.create_all()
 
 EXCESSIVE_TEXT = """Lorem ipsum dolor sit amet, consectetur adipiscing elit,
 sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.
@@ -39,6 +35,10 @@ deserunt mollit anim id est laborum."""
 
 class MessageModelTestCase(TestCase):
     def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         User.query.delete()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
@@ -125,3 +125,15 @@ class MessageModelTestCase(TestCase):
 
         self.assertIn(message, user.liked_messages)
         self.assertIn(user, message.users_liked)
+
+    def test_delete_removes_timeline_entries(self):
+        message = db.session.get(Message, self.msg_id)
+        db.session.delete(message)
+        db.session.commit()
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(message_id=self.msg_id).count(), 0)
+
+        # The next message may reuse the id (SQLite does)
+        db.session.add(Message(text="again", user_id=self.u1_id))
+        db.session.commit()
@@ -5,44 +5,47 @@
 #    FLASK_DEBUG=False python -m unittest test_message_views.py
 
 
-import os
+from datetime import datetime, timedelta
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, Message, User
+from models import db, Message, User, Like, Follow
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY
 from test_message_model import EXCESSIVE_TEXT
+from pagination import encode_cursor, MESSAGES_PER_PAGE
+from instrumentation import count_queries, query_budget
+from fragments import message_fragments
+from current_user import display_fields_cache, get_current_user
+import search
+import timelines
 
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-# This is a bit of hack, but don't use Flask DebugToolbar
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
 
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app('testing')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-db.drop_all()
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
+with app.app_context():
+    db.drop_all()
+    db.create_all()
 
 
 class MessageBaseViewTestCase(TestCase):
     def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         User.query.delete()
+        message_fragments.clear()
+        display_fields_cache.clear()
+        timelines.recent_messages.clear()
+        timelines.timeline_authors.clear()
+        search.message_index.clear()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
         db.session.flush()
@@ -56,6 +59,32 @@ class MessageBaseViewTestCase(TestCase):
 
         self.client = app.test_client()
 
+    def add_authors(self, prefix, count):
+        """Add `count` users followed by u1, each with a message u1 likes."""
+
+        authors = [
+            User.signup(f"{prefix}{i}", f"{prefix}{i}@email.com", "password")
+            for i in range(count)
+        ]
+        db.session.flush()
+
+        for author in authors:
+            db.session.add(Follow(
+                user_being_followed_id=author.id,
+                user_following_id=self.u1_id))
+        db.session.flush()
+
+        messages = [
+            Message(text=f"by-{author.username}", user_id=author.id)
+            for author in authors
+        ]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        for message in messages:
+            db.session.add(Like(user_id=self.u1_id, message_id=message.id))
+        db.session.commit()
+
 
 class MessageAddViewTestCase(MessageBaseViewTestCase):
     def test_add_message(self):
@@ -124,6 +153,24 @@ class MessageShowViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("m1-text", html)
 
+    def test_show_message_liked_star(self):
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+        u2_id = u2.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u2_id
+
+            html = c.get(f"/messages/{self.m1_id}").get_data(as_text=True)
+            self.assertIn('id="like-btn"', html)
+
+            db.session.add(Like(user_id=u2_id, message_id=self.m1_id))
+            db.session.commit()
+
+            html = c.get(f"/messages/{self.m1_id}").get_data(as_text=True)
+            self.assertIn('id="unlike-btn"', html)
+
     def test_show_message_bad_id(self):
         with self.client as c:
             with c.session_transaction() as sess:
@@ -178,6 +225,64 @@ class HomepageViewTestCase(MessageBaseViewTestCase):
             self.assertIn("m1-text", html)
             self.assertIn("home view page", html)
 
+    def test_homepage_shows_followed_messages(self):
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+        u2_id = u2.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/users/follow/{u2_id}")
+            db.session.add(Message(text="u2-new-text", user_id=u2_id))
+            db.session.commit()
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("u2-new-text", html)
+
+            c.post(f"/users/stop-following/{u2_id}")
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn("u2-new-text", html)
+            self.assertIn("m1-text", html)
+
+    def test_homepage_pagination(self):
+        db.session.add_all([
+            Message(
+                text=f"paged-{i}",
+                user_id=self.u1_id,
+                timestamp=datetime(2023, 1, 1) + timedelta(minutes=i),
+            )
+            for i in range(MESSAGES_PER_PAGE + 1)
+        ])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn(f"paged-{MESSAGES_PER_PAGE}<", html)
+            self.assertNotIn("paged-0<", html)
+
+            cursor = encode_cursor(
+                (datetime(2023, 1, 1) + timedelta(minutes=1), 0))
+            resp = c.get("/", query_string={"before": cursor})
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("paged-0<", html)
+            self.assertNotIn("paged-1<", html)
+
+    def test_homepage_bad_cursor(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/?before=not-a-cursor")
+
+            self.assertEqual(resp.status_code, 400)
+
     def test_show_homepage_user_not_logged_in(self):
         with self.client as c:
             resp = c.get("/")
@@ -185,3 +290,499 @@ class HomepageViewTestCase(MessageBaseViewTestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn("home-anon view page", html)
+
+
+class MergedHomepageViewTestCase(HomepageViewTestCase):
+    """The homepage tests again, reading the timeline through the
+    in-memory merge engine, plus tests of the engine itself."""
+
+    def setUp(self):
+        super().setUp()
+
+        app.config['TIMELINE_ENGINE'] = 'merge'
+        self.addCleanup(app.config.update, TIMELINE_ENGINE='materialized')
+
+    def add_followed(self, username):
+        user = User.signup(username, f"{username}@email.com", "password")
+        db.session.flush()
+        db.session.add(Follow(
+            user_being_followed_id=user.id, user_following_id=self.u1_id))
+        db.session.commit()
+
+        return user.id
+
+    def test_merges_authors_in_time_order(self):
+        u2_id = self.add_followed("u2")
+        u3_id = self.add_followed("u3")
+
+        db.session.add_all([
+            Message(text="old", user_id=u2_id,
+                    timestamp=datetime(2023, 1, 1)),
+            Message(text="middle", user_id=u3_id,
+                    timestamp=datetime(2023, 1, 2)),
+            Message(text="new", user_id=u2_id,
+                    timestamp=datetime(2023, 1, 3)),
+        ])
+        db.session.commit()
+
+        messages, next_cursor = timelines.home_timeline(self.u1_id)
+
+        self.assertEqual(
+            [message.text for message in messages],
+            ["m1-text", "new", "middle", "old"])
+        self.assertIsNone(next_cursor)
+
+    def test_warm_cache_skips_author_queries(self):
+        for i in range(5):
+            self.add_followed(f"author{i}")
+
+        timelines.home_timeline(self.u1_id)
+
+        with count_queries() as stats:
+            self.assertIsNotNone(timelines.home_timeline(self.u1_id))
+
+        # Just the page's messages
+        self.assertEqual(stats.count, 1)
+
+    def test_follow_reloads_authors(self):
+        u2 = User.signup("u2", "u2@email.com", "password")
+        db.session.flush()
+        db.session.add(Message(text="u2-text", user_id=u2.id))
+        db.session.commit()
+        u2_id = u2.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.assertNotIn("u2-text", c.get("/").get_data(as_text=True))
+
+            # Pins u1 to the primary, which refreshes their follows
+            c.post(f"/users/follow/{u2_id}")
+
+            self.assertIn("u2-text", c.get("/").get_data(as_text=True))
+
+    def test_remember_and_forget_message(self):
+        u2_id = self.add_followed("u2")
+        timelines.home_timeline(self.u1_id)
+
+        message = Message(text="u2-text", user_id=u2_id)
+        db.session.add(message)
+        db.session.commit()
+        timelines.remember_message(message)
+
+        messages, _ = timelines.home_timeline(self.u1_id)
+        self.assertIn("u2-text", [message.text for message in messages])
+
+        db.session.delete(message)
+        db.session.commit()
+        timelines.forget_message(message)
+
+        keys, complete = timelines.recent_messages.get(u2_id)
+        self.assertEqual(keys, ())
+        self.assertTrue(complete)
+
+    def test_falls_back_past_cached_messages(self):
+        u2_id = self.add_followed("u2")
+
+        db.session.add_all([
+            Message(text=f"u2-{i}", user_id=u2_id,
+                    timestamp=datetime(2023, 1, 1) + timedelta(minutes=i))
+            for i in range(timelines.AUTHOR_MESSAGES + 1)
+        ])
+        db.session.commit()
+
+        # u1's one message is newer, then a page's worth from u2 fits
+        page = timelines.home_timeline(self.u1_id, per_page=10)
+        self.assertEqual(len(page[0]), 10)
+
+        # The oldest of u2's messages isn't cached
+        cursor = encode_cursor((datetime(2023, 1, 1, 0, 5), 0))
+        self.assertIsNone(timelines.home_timeline(self.u1_id, cursor))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get("/", query_string={"before": cursor}).get_data(
+                as_text=True)
+            self.assertIn("u2-0<", html)
+
+
+class MessageSearchTestCase(MessageBaseViewTestCase):
+    """Message search, through the in-memory index unless the database
+    is Postgres."""
+
+    def add_messages(self, *texts):
+        messages = [Message(text=text, user_id=self.u1_id) for text in texts]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        return [message.id for message in messages]
+
+    def test_search_ranks_matches(self):
+        once, twice, _ = self.add_messages(
+            "coffee time", "coffee coffee everywhere", "tea time")
+
+        message_ids, next_cursor = search.search_messages("coffee")
+
+        self.assertEqual(message_ids, [twice, once])
+        self.assertIsNone(next_cursor)
+
+    def test_search_matches_every_term(self):
+        both, _ = self.add_messages("morning coffee", "coffee at night")
+
+        message_ids, _ = search.search_messages("coffee morning")
+
+        self.assertEqual(message_ids, [both])
+
+    def test_search_pagination(self):
+        expected = self.add_messages(*(f"warble {i}" for i in range(5)))
+
+        found = []
+        before = None
+
+        for _ in range(3):
+            message_ids, before = search.search_messages(
+                "warble", before=before, per_page=2)
+            found.extend(message_ids)
+
+        self.assertIsNone(before)
+        self.assertCountEqual(found, expected)
+
+    def test_search_ranks_newest_candidates(self):
+        _, newer, newest = self.add_messages(
+            "tea tea tea", "tea", "tea time")
+
+        with patch('search.SEARCH_CANDIDATES', 2):
+            message_ids, _ = search.search_messages("tea")
+
+        self.assertCountEqual(message_ids, [newer, newest])
+
+    def test_index_follows_adds_and_deletes(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get("/messages/search?q=m1").get_data(as_text=True)
+            self.assertIn("m1-text", html)
+
+            c.post("/messages/new", data={"text": "a brand new warble"})
+            html = c.get("/messages/search?q=brand").get_data(as_text=True)
+            self.assertIn("a brand new warble", html)
+
+            c.post(f"/messages/{self.m1_id}/delete")
+            html = c.get("/messages/search?q=m1").get_data(as_text=True)
+            self.assertNotIn("m1-text", html)
+            self.assertIn("no messages found", html)
+
+    def test_rolled_back_messages_not_indexed(self):
+        search.search_messages("anything")
+
+        db.session.add(Message(text="never committed", user_id=self.u1_id))
+        db.session.flush()
+        db.session.rollback()
+        self.add_messages("committed")
+
+        self.assertEqual(search.search_messages("never"), ([], None))
+
+    def test_search_page_without_terms(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/messages/search")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("message search page", html)
+            self.assertNotIn("no messages found", html)
+
+    def test_search_user_not_logged_in(self):
+        with self.client as c:
+            resp = c.get("/messages/search?q=m1")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, "/")
+
+
+class MessageListQueryCountTestCase(MessageBaseViewTestCase):
+    """Message lists should run the same number of queries no matter how
+    many distinct authors are on the page."""
+
+    def query_count(self, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            with count_queries() as stats:
+                resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            return stats
+
+    def assert_constant_queries(self, url):
+        # The viewer's display fields are cached after the first request;
+        # cache them up front so both counts skip that query
+        get_current_user(self.u1_id)
+
+        self.add_authors("few", 1)
+        few = self.query_count(url)
+
+        self.add_authors("many", 10)
+        many = self.query_count(url)
+
+        statements = "\n\n".join(many.statements)
+        self.assertEqual(
+            few.count, many.count,
+            f"Query count grew with the authors on the page:\n\n"
+            f"{statements}")
+
+    def test_homepage_query_count(self):
+        self.assert_constant_queries("/")
+
+    def test_likes_query_count(self):
+        self.assert_constant_queries(f"/users/{self.u1_id}/likes")
+
+    def test_show_user_query_count(self):
+        self.assert_constant_queries(f"/users/{self.u1_id}")
+
+
+class MessageFragmentCacheTestCase(MessageBaseViewTestCase):
+    """Rendered message items are reused until something they show changes."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_authors("author", 1)
+        self.author_id = User.query.filter_by(username="author0").one().id
+        self.message_id = Message.query.filter_by(text="by-author0").one().id
+
+    def get_home(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            return c.get("/").get_data(as_text=True)
+
+    def test_warm_cache_renders_same_page(self):
+        cold = self.get_home()
+        hits = message_fragments.hits
+        warm = self.get_home()
+
+        self.assertEqual(cold, warm)
+        self.assertGreater(message_fragments.hits, hits)
+        self.assertIn('name="requesting_page" hidden\n    value="http://localhost/"',
+                      warm)
+
+    def test_unlike_changes_star(self):
+        self.assertIn(f"/messages/{self.message_id}/unlike", self.get_home())
+
+        with self.client as c:
+            c.post(f"/messages/{self.message_id}/unlike",
+                   data={"requesting_page": "/"})
+
+        html = self.get_home()
+        self.assertNotIn(f"/messages/{self.message_id}/unlike", html)
+        self.assertIn(f"/messages/{self.message_id}/like", html)
+
+    def test_profile_version_invalidates(self):
+        self.get_home()
+
+        author = db.session.get(User, self.author_id)
+        author.username = "renamed"
+        author.profile_version += 1
+        db.session.commit()
+
+        self.assertIn("@renamed", self.get_home())
+
+    def test_reused_message_id_not_served_stale(self):
+        self.get_home()
+
+        # Deleted in bulk, as purging does, and the id handed out again
+        db.session.execute(
+            db.delete(Message).where(Message.id == self.message_id))
+        u2 = User.signup("u2", "u2@email.com", "password")
+        db.session.flush()
+        db.session.add(Follow(
+            user_being_followed_id=u2.id, user_following_id=self.u1_id))
+        db.session.add(Message(
+            id=self.message_id, text="recycled", user_id=u2.id))
+        db.session.flush()
+        db.session.add(Like(user_id=self.u1_id, message_id=self.message_id))
+        db.session.commit()
+
+        html = self.get_home()
+        self.assertIn("recycled", html)
+        self.assertNotIn("by-author0", html)
+
+    def test_size_accounting(self):
+        self.get_home()
+        self.assertGreater(message_fragments.stats()["bytes"], 0)
+        self.assertEqual(len(message_fragments), 2)
+
+
+class ConditionalGetTestCase(MessageBaseViewTestCase):
+    """Unchanged pages are answered with 304 Not Modified."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_authors("author", 1)
+        self.message_id = Message.query.filter_by(text="by-author0").one().id
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_revalidate_unchanged_pages(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            for url in ["/", f"/users/{self.u1_id}",
+                        f"/messages/{self.message_id}"]:
+                with self.subTest(url=url):
+                    resp = c.get(url)
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertIn("private", resp.headers["Cache-Control"])
+                    self.assertIn("no-cache", resp.headers["Cache-Control"])
+                    self.assertIn("Cookie", resp.headers["Vary"])
+
+                    etag = resp.headers["ETag"]
+                    resp = c.get(url, headers={"If-None-Match": etag})
+                    self.assertEqual(resp.status_code, 304)
+                    self.assertEqual(resp.get_data(), b"")
+
+    def test_like_changes_etag(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            etag = c.get("/").headers["ETag"]
+
+            c.post(f"/messages/{self.message_id}/unlike",
+                   data={"requesting_page": "/"})
+
+            resp = c.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_new_message_changes_etag(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            etag = c.get("/").headers["ETag"]
+
+            c.post("/messages/new", data={"text": "fresh"})
+
+            resp = c.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("fresh", resp.get_data(as_text=True))
+
+    def test_etag_differs_per_viewer(self):
+        author_id = User.query.filter_by(username="author0").one().id
+        url = f"/messages/{self.message_id}"
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            etag = c.get(url).headers["ETag"]
+
+            self.login(c, author_id)
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_untagged_pages_not_stored(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/messages/new")
+
+            self.assertNotIn("ETag", resp.headers)
+            self.assertIn("no-store", resp.headers["Cache-Control"])
+
+
+class LikeApiTestCase(MessageBaseViewTestCase):
+    """The JSON like endpoints used by warbler.js."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_authors("author", 1)
+        self.message_id = Message.query.filter_by(text="by-author0").one().id
+
+    def test_unlike_then_like(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/api/messages/{self.message_id}/unlike")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"liked": False, "likes_count": 0})
+
+            resp = c.post(f"/api/messages/{self.message_id}/like")
+            self.assertEqual(resp.json, {"liked": True, "likes_count": 1})
+
+            # Repeating a like changes nothing
+            resp = c.post(f"/api/messages/{self.message_id}/like")
+            self.assertEqual(resp.json, {"liked": True, "likes_count": 1})
+            self.assertEqual(Like.query.count(), 1)
+
+    def test_like_not_logged_in(self):
+        resp = self.client.post(f"/api/messages/{self.message_id}/like")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(Like.query.count(), 1)
+
+    def test_like_bad_message(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/api/messages/0/like")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_like_requires_csrf_header(self):
+        app.config['WTF_CSRF_ENABLED'] = True
+        self.addCleanup(app.config.update, WTF_CSRF_ENABLED=False)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/api/messages/{self.message_id}/unlike")
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(Like.query.count(), 1)
+
+            html = c.get("/").get_data(as_text=True)
+            token = html.split('name="csrf-token" content="')[1].split('"')[0]
+
+            resp = c.post(f"/api/messages/{self.message_id}/unlike",
+                          headers={"X-CSRFToken": token})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(Like.query.count(), 0)
+
+
+class ViewQueryBudgetTestCase(MessageBaseViewTestCase):
+    """Each page has a declared SQL statement budget, so an N+1 query
+    creeping into a view or template fails here."""
+
+    BUDGETS = {
+        "/": 3,
+        "/users/{u1}": 4,
+        "/users/{u1}/likes": 4,
+        "/users/{u1}/following": 4,
+        "/users/{u1}/followers": 4,
+        "/users": 3,
+        # Prefix matches, then the rest of the page from substring ones
+        "/users?q=many": 4,
+        "/messages/{m1}": 3,
+        "/messages/search?q=many": 4,
+    }
+
+    def test_views_within_query_budget(self):
+        self.add_authors("many", 10)
+
+        for url, budget in self.BUDGETS.items():
+            url = url.format(u1=self.u1_id, m1=self.m1_id)
+
+            with self.subTest(url=url), self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                with query_budget(budget):
+                    resp = c.get(url)
+
+                self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,122 @@
+"""Schema migration, query plan and database configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_schema.py
+
+
+from unittest import TestCase
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import db
+
+from app import create_app
+import database
+from instrumentation import count_queries
+import migrations
+import query_plans
+
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
+
+app = create_app('testing')
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+class MigrationTestCase(TestCase):
+    def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        migrations.schema_migrations.drop(
+            db.session.connection(), checkfirst=True)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_upgrade_current_schema(self):
+        # Everything already exists, so upgrading only records versions
+        applied = migrations.upgrade()
+
+        names = [f"{version}_{name}"
+                 for version, name, _ in migrations.available()]
+
+        self.assertEqual(applied, names)
+        self.assertEqual(migrations.pending(), [])
+        self.assertEqual(migrations.upgrade(), [])
+
+    def test_versions_unique(self):
+        versions = [version for version, _, _ in migrations.available()]
+
+        self.assertEqual(len(versions), len(set(versions)))
+
+    def test_add_column_skips_existing(self):
+        connection = db.session.connection()
+
+        self.assertFalse(migrations.add_column(
+            connection, 'users', 'profile_version', 'INTEGER'))
+        self.assertTrue(
+            migrations.has_column(connection, 'users', 'profile_version'))
+
+
+class QueryPlanTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        with app.app_context():
+            self.assertEqual(query_plans.check(), [])
+
+
+class DatabaseConfigTestCase(TestCase):
+    def test_engine_options_sized_to_threads(self):
+        options = database.engine_options(
+            "postgresql:///warbler",
+            {"WEB_THREADS": "8", "DB_STATEMENT_TIMEOUT_MS": "5000"},
+        )
+
+        self.assertIs(options["poolclass"], database.InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 8)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(
+            options["connect_args"],
+            {"options": "-c statement_timeout=5000"},
+        )
+
+    def test_engine_options_other_databases(self):
+        self.assertEqual(database.engine_options("sqlite://", {}), {})
+
+    def test_pool_stats_endpoint(self):
+        app.config['STATS_ENABLED'] = True
+        self.addCleanup(app.config.update, STATS_ENABLED=False)
+
+        resp = app.test_client().get("/_stats")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("checked_out", resp.json["db_pool"])
+
+
+class QueryTimingTestCase(TestCase):
+    def test_failed_statement_leaves_no_timer(self):
+        with app.app_context():
+            connection = db.session.connection()
+            # The pooled connection's info outlives this Connection
+            info = connection.info
+
+            with count_queries() as stats:
+                with self.assertRaises((OperationalError, ProgrammingError)):
+                    connection.execute(text("SELECT * FROM no_such_table"))
+                db.session.rollback()
+
+                db.session.execute(text("SELECT 1"))
+
+            self.assertEqual(stats.count, 1)
+            self.assertNotIn("query_started_at", info)
@@ -5,29 +5,30 @@
 #    python -m unittest test_user_model.py
 
 
-import os
+from datetime import datetime
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, User, Message, Follow, DEFAULT_IMAGE_URL
+from instrumentation import count_queries
+from models import db, User, Message, Follow, Like, TimelineEntry
+from models import DEFAULT_IMAGE_URL
 from sqlalchemy.exc import IntegrityError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
+import trimming
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
 
-# Now we can import app
-
-from app import app
+app = create_app('testing')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-db.drop_all()
-db.create_all()
+with app.app_context():
+    db.drop_all()
+    db.create_all()
 
 TEST_IMAGE_URL = 'https://upload.wikimedia.org/wikipedia/commons/'\
                             'thumb/1/11/Canis_lupus_familiaris.002_-_Monfero.j'\
@@ -36,6 +37,10 @@ TEST_IMAGE_URL = 'https://upload.wikimedia.org/wikipedia/commons/'\
 
 class UserModelTestCase(TestCase):
     def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         User.query.delete()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
@@ -97,6 +102,197 @@ class UserModelTestCase(TestCase):
 
         self.assertFalse(u2.is_followed_by(u1))
 
+    def test_following_ids(self):
+        u1 = User.query.get(self.u1_id)
+
+        db.session.add(Follow(
+            user_being_followed_id=self.u2_id,
+            user_following_id=self.u1_id))
+        db.session.commit()
+
+        self.assertEqual(
+            u1.following_ids([self.u1_id, self.u2_id]), {self.u2_id})
+        self.assertEqual(u1.following_ids([]), set())
+
+    def test_follow_backfills_timeline(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        db.session.add(Message(text="u2-text", user_id=self.u2_id))
+        db.session.commit()
+
+        u1.follow(u2)
+        db.session.commit()
+
+        entries = TimelineEntry.query.filter_by(user_id=self.u1_id).all()
+        self.assertEqual([e.author_id for e in entries], [self.u2_id])
+
+        u1.unfollow(u2)
+        db.session.commit()
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 0)
+
+    def test_rebuild_keeps_newest_entries(self):
+        u1 = User.query.get(self.u1_id)
+        u1.follow(User.query.get(self.u2_id))
+        db.session.add_all([
+            Message(text=f"u2-{day}", user_id=self.u2_id,
+                    timestamp=datetime(2023, 1, day))
+            for day in range(1, 6)
+        ])
+        db.session.commit()
+
+        with patch('models.TIMELINE_LENGTH', 3):
+            TimelineEntry.rebuild()
+        db.session.commit()
+
+        entries = (
+            TimelineEntry.query.filter_by(user_id=self.u1_id)
+            .order_by(TimelineEntry.timestamp.desc())
+            .all())
+        self.assertEqual(
+            [entry.timestamp.day for entry in entries], [5, 4, 3])
+
+    def test_trim_followers(self):
+        u2 = User.query.get(self.u2_id)
+        followers = [
+            User.signup(f"f{i}", f"f{i}@email.com", "password", None)
+            for i in range(3)
+        ]
+        db.session.flush()
+        for follower in followers:
+            follower.follow(u2)
+        db.session.add_all([
+            Message(text=f"u2-{day}", user_id=self.u2_id,
+                    timestamp=datetime(2023, 1, day))
+            for day in range(1, 6)
+        ])
+        db.session.commit()
+
+        with patch('models.TIMELINE_LENGTH', 2):
+            trimming.trim_followers(self.u2_id, batch_size=2)
+
+        for user_id in [self.u2_id] + [f.id for f in followers]:
+            days = [
+                entry.timestamp.day for entry in
+                TimelineEntry.query.filter_by(user_id=user_id)
+                .order_by(TimelineEntry.timestamp.desc())
+            ]
+            self.assertEqual(days, [5, 4])
+
+    def test_follow_many(self):
+        u1 = User.query.get(self.u1_id)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.commit()
+
+        followed = u1.follow_many([self.u2_id, u3.id, self.u1_id, 0])
+        db.session.commit()
+
+        # Ourselves and missing users are skipped; repeats change nothing
+        self.assertEqual(sorted(followed), sorted([self.u2_id, u3.id]))
+        self.assertEqual(u1.follow_many([self.u2_id]), [])
+        self.assertEqual(u1.following_count, 2)
+        self.assertTrue(u1.is_following(u3))
+
+        with count_queries() as stats:
+            unfollowed = u1.unfollow_many([self.u2_id, u3.id])
+        db.session.commit()
+
+        self.assertEqual(sorted(unfollowed), sorted([self.u2_id, u3.id]))
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(
+            (u1.following_count, u3.followers_count), (0, 0))
+        self.assertFalse(u1.unfollow(u3))
+
+    def test_follow_many_without_upsert(self):
+        u1 = User.query.get(self.u1_id)
+
+        with patch('models.UPSERT_DIALECTS', set()):
+            self.assertEqual(u1.follow_many([self.u2_id]), [self.u2_id])
+            self.assertEqual(u1.follow_many([self.u2_id]), [])
+        db.session.commit()
+
+        self.assertEqual(u1.following_count, 1)
+
+    def test_purge_user(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.follow_many([u2.id, u3.id])
+        u2.follow(u1)
+        db.session.add_all([
+            Message(text=f"u1-{i}", user_id=self.u1_id) for i in range(5)])
+        u2_msg = Message(text="u2-text", user_id=self.u2_id)
+        db.session.add(u2_msg)
+        db.session.flush()
+        db.session.add(Like(user_id=self.u1_id, message_id=u2_msg.id))
+        for msg in Message.query.filter_by(user_id=self.u1_id):
+            db.session.add(Like(user_id=self.u2_id, message_id=msg.id))
+        u1.deactivated_at = datetime.utcnow()
+        db.session.commit()
+
+        batches = 0
+        while User.purge_batch(self.u1_id, batch_size=2):
+            db.session.commit()
+            batches += 1
+        db.session.commit()
+
+        # 5 messages in 3 batches, then a like, 2 follows and a follower
+        self.assertEqual(batches, 6)
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(
+            Message.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(Follow.query.count(), 0)
+        self.assertEqual(
+            (u2.followers_count, u2.following_count, u2.likes_count,
+             u3.followers_count, u2_msg.likes_count),
+            (0, 0, 0, 0, 0))
+
+    def test_deactivated_user_cannot_log_in(self):
+        u1 = User.query.get(self.u1_id)
+        u1.deactivated_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertFalse(User.authenticate("u1", "password"))
+
+    def test_counters(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        u1.follow(u2)
+        msg = Message(text="u2-text", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add(Like(user_id=self.u1_id, message_id=msg.id))
+        db.session.commit()
+
+        self.assertEqual(
+            (u1.following_count, u1.likes_count, u2.followers_count,
+             u2.messages_count, msg.likes_count),
+            (1, 1, 1, 1, 1))
+
+        db.session.delete(msg)
+        db.session.commit()
+
+        self.assertEqual((u1.likes_count, u2.messages_count), (0, 0))
+
+    def test_repair_counters(self):
+        db.session.add(Follow(
+            user_being_followed_id=self.u2_id,
+            user_following_id=self.u1_id))
+        db.session.commit()
+
+        User.repair_counters()
+        db.session.commit()
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual((u1.following_count, u2.followers_count), (1, 1))
+
     def test_user_sign_up(self):
         new_user3 = User.signup("u3", "u3@email.com", "password", None)
         new_user4 = User.signup(
@@ -172,6 +368,21 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(User.authenticate("u1", "password"), user)
 
+    def test_authenticate_rehashes_outdated_hash(self):
+        rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.addCleanup(app.config.update, BCRYPT_LOG_ROUNDS=rounds)
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        User.signup("u3", "u3@email.com", "password", None)
+        db.session.commit()
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        user = User.authenticate("u3", "password")
+        db.session.commit()
+
+        self.assertTrue(user.password.startswith('$2b$05$'))
+        self.assertEqual(User.authenticate("u3", "password"), user)
+
     def test_authenticate_failure(self):
 
         self.assertFalse(User.authenticate("fake_user", "password"))
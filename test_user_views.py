@@ -6,43 +6,41 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
 from models import db, Message, User
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app, CURR_USER_KEY
+from replicas import REPLICA_BIND, PIN_KEY
+from sqlalchemy import create_engine
+from flask import g, session
+from instrumentation import count_queries
+from current_user import display_fields_cache
+import jobs
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+# The testing config uses TEST_DATABASE_URL, by default
+# postgresql:///warbler_test
 
-# Now we can import app
-
-from app import app, session, CURR_USER_KEY
-from flask import g
-
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-# This is a bit of hack, but don't use Flask DebugToolbar
-
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app('testing')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-db.drop_all()
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
+with app.app_context():
+    db.drop_all()
+    db.create_all()
 
 
 class UserBaseViewTestCase(TestCase):
     def setUp(self):
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         User.query.delete()
+        display_fields_cache.clear()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
         u2 = User.signup("u2", "u2@email.com", "password", None)
@@ -164,6 +162,57 @@ class UserListUserstViewTestCase(UserBaseViewTestCase):
 
 
 
+    def test_list_users_search_ranks_prefix_first(self):
+        User.signup("xbob", "xbob@email.com", "password", None)
+        User.signup("bobby", "bobby@email.com", "password", None)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/users", query_string={"q": "bob"})
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index("@bobby"), html.index("@xbob"))
+            self.assertNotIn("@u2", html)
+
+    def test_list_users_search_pages_through_tiers(self):
+        for name in ("bob", "Bobby", "bobcat", "xbob", "ybob"):
+            User.signup(name, f"{name}@email.com", "password", None)
+        db.session.commit()
+
+        found = []
+        after = None
+
+        while True:
+            users, after = User.search("BOB", after=after, per_page=2)
+            found.extend(user.username for user in users)
+            if after is None:
+                break
+
+        self.assertEqual(found, ["bob", "Bobby", "bobcat", "xbob", "ybob"])
+
+    def test_list_users_short_search_matches_prefix_only(self):
+        User.signup("xbob", "xbob@email.com", "password", None)
+        User.signup("bobby", "bobby@email.com", "password", None)
+        db.session.commit()
+
+        users, _ = User.search("bo")
+
+        self.assertEqual([user.username for user in users], ["bobby"])
+
+    def test_list_users_search_escapes_wildcards(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/users", query_string={"q": "%"})
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("Sorry, no users found", html)
+
     def test_list_users_not_logged_in(self):
         with self.client as c:
             resp = c.get("/users")
@@ -175,3 +224,243 @@ class UserListUserstViewTestCase(UserBaseViewTestCase):
 
 
     # all users (2)
+
+
+class UserFollowApiTestCase(UserBaseViewTestCase):
+    """The JSON follow endpoints used by warbler.js."""
+
+    def test_follow_then_unfollow(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/api/users/{self.u2_id}/follow")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                resp.json, {"following": True, "followers_count": 1})
+
+            # Repeating a follow changes nothing
+            resp = c.post(f"/api/users/{self.u2_id}/follow")
+            self.assertEqual(
+                resp.json, {"following": True, "followers_count": 1})
+
+            resp = c.post(f"/api/users/{self.u2_id}/stop-following")
+            self.assertEqual(
+                resp.json, {"following": False, "followers_count": 0})
+
+    def test_follow_self(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/api/users/{self.u1_id}/follow")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_follow_not_logged_in(self):
+        resp = self.client.post(f"/api/users/{self.u2_id}/follow")
+        self.assertEqual(resp.status_code, 401)
+
+
+class UserBulkFollowApiTestCase(UserBaseViewTestCase):
+    """Following and unfollowing many users in one call."""
+
+    def test_bulk_follow(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/api/follows", json={"follow": [self.u2_id, 0]})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {
+                "followed": [self.u2_id],
+                "unfollowed": [],
+                "following_count": 1,
+            })
+
+            resp = c.post("/api/follows", json={
+                "follow": [self.u2_id],
+                "unfollow": [self.u2_id],
+            })
+            self.assertEqual(resp.json, {
+                "followed": [],
+                "unfollowed": [self.u2_id],
+                "following_count": 0,
+            })
+
+    def test_bulk_follow_bad_data(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            for data in [["follow"], {"follow": "1"}, {"unfollow": ["1"]}]:
+                with self.subTest(data=data):
+                    resp = c.post("/api/follows", json=data)
+                    self.assertEqual(resp.status_code, 400)
+
+
+class ReplicaRoutingTestCase(UserBaseViewTestCase):
+    """Reads go to a second database until the user writes something."""
+
+    REPLICA_URL = os.environ.get(
+        'TEST_REPLICA_URL', "postgresql:///warbler_test_replica")
+
+    def setUp(self):
+        super().setUp()
+
+        # Stand in for replication: copy the users, plus one the primary
+        # doesn't have, so we can tell which database a page came from
+        replica = create_engine(self.REPLICA_URL)
+        db.metadata.drop_all(replica)
+        db.metadata.create_all(replica)
+
+        users = [
+            {column.name: getattr(user, column.name)
+             for column in User.__table__.columns}
+            for user in User.query.all()
+        ]
+        users.append(dict(
+            users[0], id=99999, username="replica-only",
+            email="replica@email.com"))
+
+        with replica.begin() as connection:
+            connection.execute(User.__table__.insert(), users)
+
+        db.engines[REPLICA_BIND] = replica
+        self.addCleanup(replica.dispose)
+        self.addCleanup(db.engines.pop, REPLICA_BIND)
+
+    def test_reads_go_to_replica_until_user_writes(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get("/users").get_data(as_text=True)
+            self.assertIn("@replica-only", html)
+
+            c.post(f"/users/follow/{self.u2_id}")
+
+            html = c.get("/users").get_data(as_text=True)
+            self.assertNotIn("@replica-only", html)
+
+            with c.session_transaction() as sess:
+                sess[PIN_KEY] = 0
+
+            html = c.get("/users").get_data(as_text=True)
+            self.assertIn("@replica-only", html)
+
+
+class UserDeleteViewTestCase(UserBaseViewTestCase):
+
+    def test_delete_user(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+            self.assertNotIn(CURR_USER_KEY, session)
+
+        # Deactivated at once, purged by the job queue
+        self.assertIsNotNone(
+            db.session.get(User, self.u1_id).deactivated_at)
+        db.session.rollback()
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertIsNone(db.session.get(Message, self.m1_id))
+
+    def test_deactivated_user_hidden(self):
+        u2 = db.session.get(User, self.u2_id)
+        u2.deactivated_at = datetime.utcnow()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.assertEqual(c.get(f"/users/{self.u2_id}").status_code, 404)
+            self.assertNotIn("@u2", c.get("/users").get_data(as_text=True))
+            self.assertNotIn(
+                "@u2", c.get("/users?q=u").get_data(as_text=True))
+
+
+class UserCurrentUserCacheTestCase(UserBaseViewTestCase):
+
+    def test_cached_user_skips_queries(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+
+            with count_queries() as stats:
+                resp = c.get("/messages/new")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(stats.count, 0)
+
+    def test_purged_user_logged_out(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+
+            # Purged by another worker while this one still has them cached
+            db.session.delete(db.session.get(User, self.u1_id))
+            db.session.commit()
+
+            resp = c.post("/messages/new", data={"text": "Hello"})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, "/")
+            self.assertNotIn(CURR_USER_KEY, session)
+
+    def test_deactivated_user_logged_out(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            db.session.get(User, self.u1_id).deactivated_at = (
+                datetime.utcnow())
+            db.session.commit()
+
+            resp = c.get("/messages/new")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertNotIn(CURR_USER_KEY, session)
+
+    def test_profile_edit_with_stale_cache(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+
+            # Renamed through another worker, whose cache this one missed
+            db.session.get(User, self.u1_id).username = "u1-elsewhere"
+            db.session.commit()
+
+            resp = c.post("/users/profile", data={
+                "username": "u1-renamed",
+                "password": "password",
+            })
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(
+                db.session.get(User, self.u1_id).username, "u1-renamed")
+
+    def test_profile_edit_refreshes_cache(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+            c.post("/users/profile", data={
+                "username": "u1-renamed",
+                "password": "password",
+            })
+
+            html = c.get("/messages/new").get_data(as_text=True)
+            self.assertIn("u1-renamed", html)
@@ -0,0 +1,248 @@
+"""Home timelines merged in memory from each author's recent messages.
+
+An alternative to reading the materialized timeline_entries table, used
+when TIMELINE_ENGINE is "merge". Each worker caches, per author, the
+(timestamp, id) keys of their newest AUTHOR_MESSAGES messages, newest
+first, and per viewer, the ids of the people they follow. A viewer's
+page is a k-way heap merge of the lists of the people they follow (and
+their own), so after the caches are warm a page costs one query, for the
+page's messages, and merge work proportional to the page size.
+
+- Authors missing from the cache are loaded together in one query. On
+  Postgres it reads each author's newest messages through a LATERAL
+  subquery with a LIMIT, so ix_messages_user_timestamp serves it and
+  prolific authors cost no more than quiet ones.
+- Posting and deleting update the author's list in this worker; other
+  workers pick the change up when their copy expires after AUTHOR_TTL
+  seconds. A viewer's own list and their follows are reloaded while
+  they are pinned to the primary after writing (see replicas.py), so
+  they always see their own posts and follows.
+- When a page reaches past what is cached for some author (deep pages,
+  prolific authors), home_timeline() returns None and the caller reads
+  the materialized timeline instead.
+"""
+
+import heapq
+from itertools import dropwhile
+
+from sqlalchemy import func, select, true
+
+from caching import LRUCache
+from models import db, Follow, Message, User
+from pagination import decode_cursor, encode_cursor, MESSAGES_PER_PAGE
+import replicas
+
+# A page can come entirely from one author, so keep a page's worth each
+AUTHOR_MESSAGES = MESSAGES_PER_PAGE
+AUTHOR_TTL = 30
+
+# Each cached (timestamp, id) key, or followed id, costs about this much
+# memory
+KEY_BYTES = 150
+ID_BYTES = 60
+CACHE_SIZE = 50_000
+CACHE_BYTES = 64 * 1024 * 1024
+
+# author id: (keys newest first, whether that's all of their messages)
+recent_messages = LRUCache(
+    maxsize=CACHE_SIZE, ttl=AUTHOR_TTL, maxbytes=CACHE_BYTES)
+
+# viewer id: the ids of the authors on their timeline, theirs included
+timeline_authors = LRUCache(
+    maxsize=CACHE_SIZE, ttl=AUTHOR_TTL, maxbytes=CACHE_BYTES)
+
+
+def home_timeline(user_id, before=None, per_page=MESSAGES_PER_PAGE):
+    """Return one page of `user_id`'s home timeline, newest first.
+
+    Returns (messages, next_cursor) like paginate(), or None if the
+    cached lists can't answer for this page.
+    """
+
+    cursor = None
+    if before:
+        cursor = decode_cursor(before, (Message.timestamp, Message.id))
+
+    if replicas.pinned_to_primary():
+        recent_messages.delete(user_id)
+        timeline_authors.delete(user_id)
+
+    lists = author_lists(authors_of(user_id))
+
+    # Older than the oldest key of a list that was cut short, the merge
+    # could be missing that author's messages
+    horizon = max(
+        (keys[-1] for keys, complete in lists if keys and not complete),
+        default=None,
+    )
+
+    merged = heapq.merge(
+        *(dropwhile(lambda key: key >= cursor, keys) if cursor else keys
+          for keys, complete in lists),
+        reverse=True,
+    )
+
+    page = []
+
+    for key in merged:
+        if horizon is not None and key < horizon:
+            return None
+
+        page.append(key)
+
+        if len(page) > per_page:
+            break
+
+    else:
+        if horizon is not None:
+            return None
+
+    next_cursor = None
+    if len(page) > per_page:
+        page = page[:per_page]
+        next_cursor = encode_cursor(page[-1])
+
+    message_ids = [message_id for _, message_id in page]
+
+    return Message.in_order(message_ids), next_cursor
+
+
+def authors_of(user_id):
+    """Return the cached ids of `user_id` and the people they follow."""
+
+    author_ids = timeline_authors.get(user_id)
+
+    if author_ids is None:
+        followed = db.session.scalars(
+            select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == user_id))
+        author_ids = frozenset(followed) | {user_id}
+        timeline_authors.set(
+            user_id, author_ids, size=len(author_ids) * ID_BYTES)
+
+    return author_ids
+
+
+def author_lists(author_ids):
+    """Return the cached (keys, complete) of each of `author_ids`,
+    loading the missing ones in one query."""
+
+    lists = {}
+    missing = []
+
+    for author_id in author_ids:
+        cached = recent_messages.get(author_id)
+
+        if cached is None:
+            missing.append(author_id)
+        else:
+            lists[author_id] = cached
+
+    if missing:
+        lists.update(load_authors(missing))
+
+    return list(lists.values())
+
+
+def load_authors(author_ids):
+    """Read and cache the newest messages of each of `author_ids`."""
+
+    # One more than we keep, to tell whether a list is complete
+    if db.engine.dialect.name == 'postgresql':
+        statement = newest_messages_lateral(author_ids, AUTHOR_MESSAGES + 1)
+    else:
+        statement = newest_messages_ranked(author_ids, AUTHOR_MESSAGES + 1)
+
+    rows = db.session.execute(statement)
+
+    keys = {author_id: [] for author_id in author_ids}
+    for author_id, timestamp, message_id in rows:
+        keys[author_id].append((timestamp, message_id))
+
+    loaded = {}
+
+    for author_id, author_keys in keys.items():
+        author_keys.sort(reverse=True)
+        entry = (
+            tuple(author_keys[:AUTHOR_MESSAGES]),
+            len(author_keys) <= AUTHOR_MESSAGES,
+        )
+        recent_messages.set(
+            author_id, entry, size=len(entry[0]) * KEY_BYTES)
+        loaded[author_id] = entry
+
+    return loaded
+
+
+def newest_messages_lateral(author_ids, limit):
+    """(user_id, timestamp, id) of each author's newest `limit` messages,
+    one index range scan per author."""
+
+    authors = (
+        select(User.id.label('user_id'))
+        .where(User.id.in_(author_ids))
+        .subquery()
+    )
+
+    newest = (
+        select(Message.timestamp, Message.id)
+        .where(Message.user_id == authors.c.user_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+        .lateral()
+    )
+
+    return (
+        select(authors.c.user_id, newest.c.timestamp, newest.c.id)
+        .select_from(authors.join(newest, true()))
+    )
+
+
+def newest_messages_ranked(author_ids, limit):
+    """(user_id, timestamp, id) of each author's newest `limit` messages,
+    for databases without LATERAL (SQLite). Ranks every message of the
+    authors, so it's only for small ones."""
+
+    ranked = (
+        select(
+            Message.user_id,
+            Message.timestamp,
+            Message.id,
+            func.row_number().over(
+                partition_by=Message.user_id,
+                order_by=(Message.timestamp.desc(), Message.id.desc()),
+            ).label('position'),
+        )
+        .where(Message.user_id.in_(author_ids))
+        .subquery()
+    )
+
+    return (
+        select(ranked.c.user_id, ranked.c.timestamp, ranked.c.id)
+        .where(ranked.c.position <= limit)
+    )
+
+
+def remember_message(message):
+    """Add a new `message` to its author's cached list, if there is one."""
+
+    key = (message.timestamp, message.id)
+
+    def add(entry):
+        keys, complete = entry
+        keys = tuple(sorted(keys + (key,), reverse=True))
+        if len(keys) > AUTHOR_MESSAGES:
+            return keys[:AUTHOR_MESSAGES], False
+        return keys, complete
+
+    recent_messages.update(message.user_id, add)
+
+
+def forget_message(message):
+    """Drop a deleted `message` from its author's cached list."""
+
+    def remove(entry):
+        keys, complete = entry
+        return tuple(key for key in keys if key[1] != message.id), complete
+
+    recent_messages.update(message.user_id, remove)
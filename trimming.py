@@ -0,0 +1,78 @@
+"""Keeping materialized home timelines to TIMELINE_LENGTH entries.
+
+Fan-out only ever adds timeline entries; trimming every follower's
+timeline in the request that posts would make posting cost a scan per
+follower. Instead, posting a message enqueues a trim_followers job for
+its author, at most one per author per TRIM_INTERVAL and due at the end
+of it. A job worker then trims just the timelines that author's messages
+went to, TRIM_BATCH_SIZE followers per statement and transaction.
+
+A timeline can run past TIMELINE_LENGTH by what its authors post in one
+interval, which pagination doesn't mind.
+
+To trim every timeline right away:
+
+    flask trim-timelines
+"""
+
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+import jobs
+from models import db, Follow, TimelineEntry
+
+TRIM_INTERVAL = 300
+TRIM_BATCH_SIZE = 500
+
+# Seconds a worker may spend trimming before the job is retried
+TRIM_TIMEOUT = 3600
+
+
+@jobs.task('trim_followers', timeout=TRIM_TIMEOUT)
+def trim_followers(author_id, batch_size=TRIM_BATCH_SIZE):
+    """Trim the timelines of `author_id` and their followers."""
+
+    TimelineEntry.trim_many([author_id])
+    db.session.commit()
+
+    after = 0
+
+    while True:
+        follower_ids = db.session.scalars(
+            select(Follow.user_following_id)
+            .where(Follow.user_being_followed_id == author_id)
+            .where(Follow.user_following_id > after)
+            .order_by(Follow.user_following_id)
+            .limit(batch_size)
+        ).all()
+
+        if not follower_ids:
+            break
+
+        TimelineEntry.trim_many(follower_ids)
+        db.session.commit()
+        after = follower_ids[-1]
+
+
+def trim_timelines():
+    """Trim every timeline back to TIMELINE_LENGTH entries."""
+
+    TimelineEntry.trim_all()
+    db.session.commit()
+
+
+def enqueue_trim(author_id, now=None):
+    """Queue trimming the timelines `author_id` posts to, at the end of
+    the current interval, with the caller's transaction, unless that's
+    queued already."""
+
+    interval = int((now or time.time()) // TRIM_INTERVAL)
+
+    return jobs.enqueue(
+        'trim_followers',
+        {'author_id': author_id},
+        idempotency_key=f'trim-followers-{author_id}-{interval}',
+        run_at=datetime.utcfromtimestamp((interval + 1) * TRIM_INTERVAL),
+    )